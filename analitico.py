@@ -0,0 +1,250 @@
+# Instantâneo analítico: cópia colunar (Parquet) dos atendimentos para análises de vários
+# anos (faturamento por função, profissional, período do dia, mês...) sem consultar o
+# SQLite do app. A atualização é incremental: relê do banco só as linhas que entraram no
+# log de mudanças desde a última vez (ver LOG DE MUDANÇAS no banco.py). A tela de Análises
+# lê só o arquivo; a atualização roda pelo botão do admin ou agendada fora do expediente:
+#
+#     python analitico.py                  # incremental (completo na primeira vez)
+#     python analitico.py --completo       # relê o banco principal e os arquivos anuais
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import banco
+import desempenho
+
+# paciente/detalhes ficam de fora: não entram nas análises e não precisam de uma segunda cópia
+COLUNAS = ('id', 'inicio', 'termino', 'funcao', 'funcao_id', 'valor_total', 'usuario_responsavel', 'periodo')
+CATEGORICAS = ('funcao', 'usuario_responsavel', 'periodo')
+TAMANHO_GRUPO = 100_000  # linhas por row group (o arquivo é gravado ordenado por inicio)
+META_SEQ = b'atendimentos.seq'
+META_GERADO = b'atendimentos.gerado_em'
+
+_trava = threading.Lock()  # uma atualização por vez no processo
+_trava_carga = threading.Lock()
+_carregado = {'chave': None, 'df': None}  # último arquivo lido, por (caminho, mtime, tamanho)
+
+
+# --- INSTANTÂNEO ---
+def caminho_instantaneo():
+    # Ao lado do banco principal: atendimentos.db -> atendimentos_analitico.parquet
+    return os.path.splitext(os.path.abspath(banco.obter_banco().caminho))[0] + '_analitico.parquet'
+
+def _ler_metadados(caminho):
+    try: meta = pq.read_schema(caminho).metadata or {}
+    except (FileNotFoundError, pa.ArrowInvalid): return None
+    if META_SEQ not in meta: return None
+    return {'seq': int(meta[META_SEQ]), 'gerado_em': datetime.fromisoformat(meta[META_GERADO].decode())}
+
+def _ler_linhas(conn, origem, where='', params=()):
+    df = pd.read_sql(f"SELECT {', '.join(COLUNAS)} FROM {origem}" + (f' WHERE {where}' if where else ''),
+                     conn, params=params)
+    df['inicio'] = pd.to_datetime(df['inicio'], unit='s')
+    df['termino'] = pd.to_datetime(df['termino'], unit='s')
+    df['funcao_id'] = df['funcao_id'].astype('Int64')
+    for col in CATEGORICAS:
+        df[col] = df[col].fillna('')
+    return df
+
+def _ler_arquivados(conn, arquivos, where='', params=()):
+    # Os anexos são limitados (MAX_ANEXOS): lê os anos arquivados em blocos
+    anos, partes = sorted(arquivos), []
+    for i in range(0, len(anos), banco.MAX_ANEXOS):
+        bloco = {ano: arquivos[ano] for ano in anos[i:i + banco.MAX_ANEXOS]}
+        for esquema in banco.anexar(conn, bloco):
+            partes.append(_ler_linhas(conn, f'{esquema}.atendimentos', where, params))
+    return partes
+
+def _ler_mudancas(conn, seq_anterior):
+    # None quando o log não cobre mais a marca do instantâneo (banco trocado/restaurado,
+    # ou log limpo por outro instantâneo): aí só a releitura completa é confiável
+    conn.execute('BEGIN')
+    try:
+        atual = conn.execute("SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'mudancas'").fetchone()[0]
+        primeiro = conn.execute('SELECT min(seq) FROM mudancas').fetchone()[0]
+        if seq_anterior > atual or (atual > seq_anterior and (primeiro is None or primeiro > seq_anterior + 1)):
+            return None
+        faixa = (seq_anterior, atual)
+        ids = {row[0] for row in conn.execute('SELECT DISTINCT id FROM mudancas WHERE seq > ? AND seq <= ?', faixa)}
+        df = _ler_linhas(conn, 'main.atendimentos', 'id IN (SELECT id FROM main.mudancas WHERE seq > ? AND seq <= ?)', faixa)
+        arquivos = banco.arquivos_registrados(conn)
+    finally:
+        conn.execute('COMMIT')
+    partes = [df]
+    if arquivos and ids - set(df['id']):
+        # Linha alterada e depois arquivada antes desta atualização: está num arquivo anual
+        partes += _ler_arquivados(conn, arquivos, 'id IN (SELECT id FROM main.mudancas WHERE seq > ? AND seq <= ?)', faixa)
+    return atual, ids, partes
+
+def _ler_tudo(conn):
+    conn.execute('BEGIN')
+    try:
+        atual = conn.execute("SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'mudancas'").fetchone()[0]
+        partes = [_ler_linhas(conn, 'main.atendimentos')]
+        arquivos = banco.arquivos_registrados(conn)
+    finally:
+        conn.execute('COMMIT')
+    return atual, partes + _ler_arquivados(conn, arquivos)
+
+def _gravar(df, caminho, seq):
+    # Anos arquivados durante a leitura podem aparecer no principal e no arquivo: fica a primeira
+    df = df.drop_duplicates('id').sort_values(['inicio', 'id'], ignore_index=True)
+    for col in CATEGORICAS:
+        df[col] = df[col].astype('category')
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    tabela = tabela.replace_schema_metadata({**(tabela.schema.metadata or {}), META_SEQ: str(seq).encode(),
+                                             META_GERADO: datetime.now().isoformat(timespec='seconds').encode()})
+    # Grava ao lado e troca de uma vez: quem está lendo nunca vê um arquivo pela metade
+    pq.write_table(tabela, caminho + '.tmp', row_group_size=TAMANHO_GRUPO, compression='zstd')
+    os.replace(caminho + '.tmp', caminho)
+    return len(df)
+
+@desempenho.instrumentar
+def atualizar(completo=False):
+    # Devolve {'modo', 'alteradas', 'linhas', 'seq'}
+    caminho = caminho_instantaneo()
+    with _trava:
+        meta = None if completo else _ler_metadados(caminho)
+        conn = banco.leitura()
+        mudancas = _ler_mudancas(conn, meta['seq']) if meta else None
+        if mudancas is None:
+            seq, partes = _ler_tudo(conn)
+            modo, alteradas = 'completo', sum(len(p) for p in partes)
+            df = pd.concat(partes, ignore_index=True)
+        else:
+            seq, ids, partes = mudancas
+            modo, alteradas = 'incremental', len(ids)
+            if seq == meta['seq']:
+                return {'modo': modo, 'alteradas': 0, 'linhas': pq.read_metadata(caminho).num_rows, 'seq': seq}
+            base = pq.read_table(caminho).to_pandas()
+            # Excluídas somem (não estão em partes); alteradas entram com os valores novos
+            df = pd.concat([base[~base['id'].isin(ids)]] + partes, ignore_index=True)
+        linhas = _gravar(df, caminho, seq)
+    # O que já está no arquivo não precisa mais ficar no log
+    banco.limpar_mudancas(seq)
+    return {'modo': modo, 'alteradas': alteradas, 'linhas': linhas, 'seq': seq}
+
+def informacoes():
+    caminho = caminho_instantaneo()
+    meta = _ler_metadados(caminho)
+    if meta is None: return None
+    return {**meta, 'linhas': pq.read_metadata(caminho).num_rows, 'bytes': os.path.getsize(caminho)}
+
+def _carregar():
+    # Mantém em memória o último arquivo lido; um arquivo novo (atualização) troca a chave
+    caminho = caminho_instantaneo()
+    try: estado = os.stat(caminho)
+    except FileNotFoundError: return None
+    chave = (caminho, estado.st_mtime_ns, estado.st_size)
+    with _trava_carga:
+        if _carregado['chave'] != chave:
+            df = pq.read_table(caminho).to_pandas()
+            df['horas'] = (df['termino'] - df['inicio']).dt.total_seconds() / 3600
+            _carregado.update(chave=chave, df=df)
+        return _carregado['df']
+
+
+# --- ANÁLISES ---
+# Tudo vetorizado sobre o DataFrame em memória: filtro por máscaras, groupby e unstack.
+DIMENSOES = {
+    'funcao': 'Função', 'usuario_responsavel': 'Profissional', 'periodo': 'Período',
+    'ano': 'Ano', 'trimestre': 'Trimestre', 'mes': 'Mês', 'semana': 'Semana', 'dia_semana': 'Dia da Semana',
+}
+MEDIDAS = {'valor': 'Faturamento (R$)', 'horas': 'Horas', 'qtd': 'Atendimentos', 'ticket': 'Valor Médio (R$)'}
+DIAS_SEMANA = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
+
+def _filtrar(acesso, inicio=None, fim=None, funcao=None, usuario=None):
+    # Mesmas regras do serviço: usuário comum só enxerga os próprios atendimentos
+    df = _carregar()
+    if df is None: return pd.DataFrame(columns=list(COLUNAS) + ['horas'])
+    if acesso.tipo != 'admin': usuario = acesso.usuario
+    mascara = pd.Series(True, index=df.index)
+    if inicio is not None: mascara &= df['inicio'] >= pd.Timestamp(inicio)
+    if fim is not None: mascara &= df['inicio'] < pd.Timestamp(fim)
+    if funcao is not None: mascara &= df['funcao'] == funcao
+    if usuario is not None: mascara &= df['usuario_responsavel'] == usuario
+    return df[mascara]
+
+def _chave(df, dimensao):
+    # Chaves numéricas/Period agrupam e ordenam rápido; os rótulos são aplicados no resultado
+    if dimensao in CATEGORICAS: return df[dimensao]
+    datas = df['inicio'].dt
+    if dimensao == 'ano': return datas.year.rename('ano')
+    if dimensao == 'dia_semana': return datas.dayofweek.rename('dia_semana')
+    frequencia = {'trimestre': 'Q', 'mes': 'M', 'semana': 'W-SUN'}[dimensao]
+    return datas.to_period(frequencia).rename(dimensao)
+
+def _rotular(indice, dimensao):
+    if dimensao == 'dia_semana': return indice.map(lambda d: DIAS_SEMANA[d])
+    if dimensao == 'semana': return indice.map(lambda p: p.start_time.strftime('%d/%m/%Y'))
+    if dimensao in ('trimestre', 'mes'): return indice.map(str)
+    return indice
+
+def _medida(somas, medida):
+    if medida == 'ticket': return somas['valor_total'] / somas['qtd']
+    return somas[{'valor': 'valor_total', 'horas': 'horas', 'qtd': 'qtd'}[medida]]
+
+@desempenho.instrumentar
+def analisar(acesso, inicio=None, fim=None, linhas='funcao', colunas=None, medida='valor', funcao=None, usuario=None):
+    # Tabela dinâmica linhas x colunas da medida no intervalo [inicio, fim), com linha e coluna de Total
+    if linhas not in DIMENSOES or (colunas is not None and colunas not in DIMENSOES) or medida not in MEDIDAS:
+        raise ValueError('Dimensão ou medida inválida.')
+    if colunas == linhas: colunas = None
+    df = _filtrar(acesso, inicio, fim, funcao, usuario)
+    if df.empty: return pd.DataFrame()
+    componentes = df[['valor_total', 'horas']].assign(qtd=1)
+    k_linhas = _chave(df, linhas)
+    por_linha = _medida(componentes.groupby(k_linhas, observed=True).sum(), medida)
+    total = [_medida(componentes.sum(), medida)]
+    if colunas is None:
+        tabela = por_linha.to_frame(MEDIDAS[medida])
+    else:
+        k_colunas = _chave(df, colunas)
+        somas = componentes.groupby([k_linhas, k_colunas], observed=True).sum()
+        tabela = _medida(somas, medida).unstack(fill_value=None if medida == 'ticket' else 0)
+        tabela.columns = pd.Index([str(r) for r in _rotular(tabela.columns, colunas)], name=DIMENSOES[colunas])
+        tabela['Total'] = por_linha.values
+        total = _medida(componentes.groupby(k_colunas, observed=True).sum(), medida).tolist() + total
+    tabela.index = pd.Index([str(r) for r in _rotular(tabela.index, linhas)], name=DIMENSOES[linhas])
+    tabela.loc['Total'] = total
+    return tabela
+
+def distintos(acesso, coluna):
+    # Opções de filtro tiradas do próprio instantâneo (sem consultar o banco)
+    df = _filtrar(acesso)
+    return sorted(v for v in df[coluna].unique().tolist() if v) if not df.empty else []
+
+@desempenho.instrumentar
+def resumir(acesso, inicio=None, fim=None, funcao=None, usuario=None):
+    df = _filtrar(acesso, inicio, fim, funcao, usuario)
+    return {'valor': float(df['valor_total'].sum()), 'horas': float(df['horas'].sum()), 'qtd': len(df)}
+
+def atualizar_instantaneo(acesso, completo=False):
+    if acesso.tipo != 'admin':
+        raise PermissionError('Acesso restrito ao administrador.')
+    return atualizar(completo)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Atualiza o instantâneo analítico (Parquet) dos atendimentos')
+    p.add_argument('--completo', action='store_true', help='relê tudo em vez de só as mudanças')
+    p.add_argument('--banco', default=banco.CAMINHO_PADRAO, help='arquivo SQLite (o mesmo do app)')
+    args = p.parse_args(argv)
+
+    banco.configurar(args.banco)
+    banco.inicializar()
+    t = time.perf_counter()
+    r = atualizar(args.completo)
+    print(f"{caminho_instantaneo()}: {r['modo']}, {r['alteradas']} linhas relidas, {r['linhas']} no total "
+          f"({time.perf_counter() - t:.2f}s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+# API HTTP/JSON local sobre o servico.py, para integrações e scripts que não passam
+# pela interface do Streamlit. Autenticação HTTP Basic com os mesmos usuários do app;
+# as regras de acesso são as do serviço (usuário comum só vê e altera o que é seu).
+#
+#     python api.py --porta 8502
+#     curl -u admin:admin123 'http://127.0.0.1:8502/atendimentos?ano=2024&mes=5'
+#
+# Rotas:
+#     GET    /funcoes                      POST /funcoes {nome, valor_hora}
+#     PUT    /funcoes/<id>                 DELETE /funcoes/<id>
+#     POST   /funcoes/<id>/reprecificar {inicio, fim}   (admin; recalcula valor_total)
+#     GET    /atendimentos?ano=&mes=&inicio=&fim=&funcao=&usuario=
+#     GET    /atendimentos/busca?q=&limite=&apos=<inicio>,<id>
+#     POST   /atendimentos {inicio, termino, funcao, paciente, detalhes, usuario_responsavel}
+#     PUT    /atendimentos/<id>            DELETE /atendimentos/<id>
+#     GET    /atendimentos/conflitos       (admin; pares de atendimentos sobrepostos)
+#     GET    /atendimentos/exportar?formato=xlsx|csv.gz&ano=&mes=&inicio=&fim=&funcao=&usuario=
+#     GET    /anos                         GET /metricas?ano=&mes=&funcao=&usuario=
+import argparse
+import base64
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import banco
+import relatorios
+import servico
+
+Anexo = namedtuple('Anexo', ['caminho', 'tipo', 'nome'])  # resposta em arquivo (temporário, apagado após o envio)
+_log = logging.getLogger('atendimentos.api')
+
+
+# --- CONVERSÕES ---
+def _data(valor, campo):
+    try: return datetime.fromisoformat(valor)
+    except (TypeError, ValueError): raise ValueError(f"Data inválida em '{campo}': {valor!r}")
+
+def _registros(df):
+    # DataFrame -> lista de dicts JSON (datas em ISO 8601, sem fuso, como foram digitadas)
+    return json.loads(df.to_json(orient='records', date_format='iso', date_unit='s')) if not df.empty else []
+
+def _periodo_consulta(q):
+    if 'ano' in q and 'mes' in q: return servico.intervalo_mes(int(q['ano']), int(q['mes']))
+    return (_data(q['inicio'], 'inicio') if 'inicio' in q else None,
+            _data(q['fim'], 'fim') if 'fim' in q else None)
+
+
+# --- ROTAS ---
+def listar_funcoes(acesso, q, corpo):
+    return 200, _registros(servico.carregar_funcoes())
+
+def criar_funcao(acesso, q, corpo):
+    servico.salvar_funcao(corpo['nome'], float(corpo['valor_hora']))
+    return 201, {'ok': True}
+
+def alterar_funcao(acesso, q, corpo, id_func):
+    servico.atualizar_funcao(id_func, corpo['nome'], float(corpo['valor_hora']))
+    return 200, {'ok': True}
+
+def remover_funcao(acesso, q, corpo, id_func):
+    servico.excluir_funcao(id_func)
+    return 200, {'ok': True}
+
+def reprecificar(acesso, q, corpo, id_func):
+    qtd = servico.reprecificar_atendimentos(
+        acesso, id_func, _data(corpo['inicio'], 'inicio') if corpo.get('inicio') else None,
+        _data(corpo['fim'], 'fim') if corpo.get('fim') else None)
+    return 200, {'atualizados': qtd}
+
+def listar_atendimentos(acesso, q, corpo):
+    inicio, fim = _periodo_consulta(q)
+    df = servico.carregar_atendimentos(acesso, inicio, fim, funcao=q.get('funcao'), usuario=q.get('usuario'))
+    return 200, _registros(df)
+
+def buscar(acesso, q, corpo):
+    apos = tuple(int(v) for v in q['apos'].split(',')) if q.get('apos') else None
+    df, proximo = servico.buscar_atendimentos(acesso, q.get('q', ''), int(q.get('limite', 20)), apos, q.get('usuario'))
+    return 200, {'atendimentos': _registros(df), 'proximo': ','.join(map(str, proximo)) if proximo else None}
+
+def conflitos(acesso, q, corpo):
+    return 200, _registros(servico.auditar_conflitos(acesso))
+
+def exportar(acesso, q, corpo):
+    formato = q.get('formato', 'xlsx')
+    if formato not in relatorios.FORMATOS_EXPORTACAO: raise ValueError(f"Formato inválido: {formato!r}")
+    inicio, fim = _periodo_consulta(q)
+    caminho = relatorios.exportar_lotes(*servico.exportar_atendimentos(acesso, inicio, fim, q.get('funcao'), q.get('usuario')),
+                                        formato)
+    sufixo, tipo = relatorios.FORMATOS_EXPORTACAO[formato]
+    return 200, Anexo(caminho, tipo, 'atendimentos' + sufixo)
+
+def criar_atendimento(acesso, q, corpo):
+    id_atend, total = servico.salvar_atendimento(
+        acesso, _data(corpo.get('inicio'), 'inicio'), _data(corpo.get('termino'), 'termino'), corpo.get('funcao'),
+        corpo.get('paciente'), corpo.get('detalhes', ''), corpo.get('usuario_responsavel'))
+    return 201, {'id': id_atend, 'valor_total': total}
+
+def alterar_atendimento(acesso, q, corpo, id_atend):
+    total = servico.atualizar_atendimento(
+        acesso, id_atend, _data(corpo.get('inicio'), 'inicio'), _data(corpo.get('termino'), 'termino'),
+        corpo.get('funcao'), corpo.get('paciente'), corpo.get('detalhes', ''))
+    return 200, {'id': id_atend, 'valor_total': total}
+
+def remover_atendimento(acesso, q, corpo, id_atend):
+    servico.excluir_atendimento(acesso, id_atend)
+    return 200, {'ok': True}
+
+def anos(acesso, q, corpo):
+    return 200, servico.listar_anos(acesso)
+
+def metricas(acesso, q, corpo):
+    return 200, servico.carregar_metricas(acesso, int(q['ano']), int(q['mes']), q.get('funcao'), q.get('usuario'))
+
+ROTAS = [
+    ('GET', r'/funcoes', listar_funcoes),
+    ('POST', r'/funcoes', criar_funcao),
+    ('PUT', r'/funcoes/(\d+)', alterar_funcao),
+    ('DELETE', r'/funcoes/(\d+)', remover_funcao),
+    ('POST', r'/funcoes/(\d+)/reprecificar', reprecificar),
+    ('GET', r'/atendimentos', listar_atendimentos),
+    ('GET', r'/atendimentos/busca', buscar),
+    ('GET', r'/atendimentos/conflitos', conflitos),
+    ('GET', r'/atendimentos/exportar', exportar),
+    ('POST', r'/atendimentos', criar_atendimento),
+    ('PUT', r'/atendimentos/(\d+)', alterar_atendimento),
+    ('DELETE', r'/atendimentos/(\d+)', remover_atendimento),
+    ('GET', r'/anos', anos),
+    ('GET', r'/metricas', metricas),
+]
+ROTAS = [(metodo, re.compile(padrao + '/?'), func) for metodo, padrao, func in ROTAS]
+
+
+# --- SERVIDOR ---
+class Manipulador(BaseHTTPRequestHandler):
+    server_version = 'AtendimentosAPI/1.0'
+
+    def _autenticar(self):
+        cabecalho = self.headers.get('Authorization', '')
+        if not cabecalho.startswith('Basic '): return None
+        try: usuario, _, senha = base64.b64decode(cabecalho[6:]).decode('utf-8').partition(':')
+        except ValueError: return None
+        return servico.autenticar(usuario, senha)
+
+    def _responder(self, status, dados):
+        corpo = json.dumps(dados, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        if status == 401: self.send_header('WWW-Authenticate', 'Basic realm="atendimentos"')
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _enviar_arquivo(self, anexo):
+        # Envia do disco em blocos: a memória não cresce com o tamanho do arquivo
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', anexo.tipo)
+            self.send_header('Content-Length', str(os.path.getsize(anexo.caminho)))
+            self.send_header('Content-Disposition', f'attachment; filename="{anexo.nome}"')
+            self.end_headers()
+            with open(anexo.caminho, 'rb') as f: shutil.copyfileobj(f, self.wfile, 64 * 1024)
+        finally:
+            os.remove(anexo.caminho)
+
+    def _despachar(self, metodo):
+        url = urlsplit(self.path)
+        candidatas = [(m, r.fullmatch(url.path), f) for m, r, f in ROTAS]
+        candidatas = [(m, achado, f) for m, achado, f in candidatas if achado]
+        if not candidatas: return self._responder(404, {'erro': 'Rota não encontrada.'})
+        rota = next(((achado, f) for m, achado, f in candidatas if m == metodo), None)
+        if rota is None: return self._responder(405, {'erro': 'Método não permitido.'})
+        achado, func = rota
+        try:
+            acesso = self._autenticar()
+            if acesso is None: return self._responder(401, {'erro': 'Usuário ou senha inválidos.'})
+            q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            tamanho = int(self.headers.get('Content-Length') or 0)
+            corpo = json.loads(self.rfile.read(tamanho) or b'{}') if tamanho else {}
+            if not isinstance(corpo, dict): raise ValueError('O corpo da requisição deve ser um objeto JSON.')
+            status, dados = func(acesso, q, corpo, *(int(g) for g in achado.groups()))
+        except PermissionError as e: status, dados = 403, {'erro': str(e)}
+        except TimeoutError as e: status, dados = 503, {'erro': str(e)}
+        except KeyError as e: status, dados = 400, {'erro': f"Campo obrigatório ausente: {e.args[0]}"}
+        except LookupError as e: status, dados = 404, {'erro': str(e)}
+        except (ValueError, TypeError) as e: status, dados = 400, {'erro': str(e)}
+        except Exception:
+            # Inesperado (ex.: banco travado por outro processo): registra e responde, sem derrubar a thread
+            _log.exception('Erro em %s %s', metodo, url.path)
+            status, dados = 500, {'erro': 'Erro interno do servidor.'}
+        if isinstance(dados, Anexo): return self._enviar_arquivo(dados)
+        self._responder(status, dados)
+
+    def do_GET(self): self._despachar('GET')
+    def do_POST(self): self._despachar('POST')
+    def do_PUT(self): self._despachar('PUT')
+    def do_DELETE(self): self._despachar('DELETE')
+
+class ServidorAPI(ThreadingHTTPServer):
+    # Requisições atendidas por um pool fixo de threads (em vez de uma thread por
+    # requisição): as conexões de leitura por thread do banco.py são reaproveitadas
+    def __init__(self, endereco, threads=8):
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='api')
+        super().__init__(endereco, Manipulador)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='API HTTP/JSON local dos atendimentos')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--porta', type=int, default=8502)
+    p.add_argument('--threads', type=int, default=8, help='requisições atendidas em paralelo')
+    p.add_argument('--banco', default=banco.CAMINHO_PADRAO, help='arquivo SQLite (o mesmo do app)')
+    args = p.parse_args(argv)
+
+    banco.configurar(args.banco)
+    banco.inicializar()
+    servidor = ServidorAPI((args.host, args.porta), args.threads)
+    print(f'API em http://{args.host}:{args.porta} ({args.threads} threads)', file=sys.stderr)
+    try: servidor.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: servidor.server_close()
+
+
+if __name__ == '__main__':
+    main()
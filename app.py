@@ -1,10 +1,9 @@
-import streamlit as st
-import pandas as pd
 import sqlite3
-from datetime import datetime, timedelta
-import io
-import hashlib
-from fpdf import FPDF
+import streamlit as st
+from datetime import date, datetime, time, timedelta
+import banco
+import desempenho
+from autenticacao import Acesso, autenticar
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
@@ -14,12 +13,12 @@ st.set_page_config(
 )
 
 # --- ESTILIZAÇÃO ---
+# Sem fontes externas: nenhum download de terceiros bloqueia a primeira pintura (nem falha na
+# rede offline). Open Sans vem do próprio app (static/fonts, [[theme.fontFaces]] em .streamlit/config.toml).
 st.markdown("""
     <style>
-    @import url('https://fonts.googleapis.com/css2?family=Open+Sans:wght@300;400;600;700&display=swap');
-    
     html, body, h1, h2, h3, h4, h5, h6, p, li, ol, .stButton button, .stTextInput, .stSelectbox, .stTextArea {
-        font-family: 'Open Sans', sans-serif !important;
+        font-family: 'Open Sans', system-ui, -apple-system, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif !important;
     }
     
     [data-testid="stMetricValue"] {
@@ -33,228 +32,18 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# --- FUNÇÕES DE SEGURANÇA ---
-def make_hashes(password):
-    return hashlib.sha256(str.encode(password)).hexdigest()
-
-def check_hashes(password, hashed_text):
-    if make_hashes(password) == hashed_text:
-        return True
-    return False
-
-# --- BANCO DE DADOS ---
-def init_db():
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    
-    # Tabela Usuários
-    c.execute('''CREATE TABLE IF NOT EXISTS usuarios 
-                 (username TEXT PRIMARY KEY, password TEXT, tipo TEXT)''')
-    c.execute('SELECT count(*) FROM usuarios')
-    if c.fetchone()[0] == 0:
-        c.execute('INSERT INTO usuarios VALUES (?, ?, ?)', ('admin', make_hashes('admin123'), 'admin'))
-    
-    # Tabela Funções
-    c.execute('''CREATE TABLE IF NOT EXISTS funcoes 
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT, valor_hora REAL)''')
-    
-    # Tabela Atendimentos (Completa)
-    c.execute('''CREATE TABLE IF NOT EXISTS atendimentos 
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, inicio TEXT, termino TEXT, 
-                  funcao TEXT, valor_total REAL, usuario_responsavel TEXT, detalhes TEXT,
-                  paciente TEXT, periodo TEXT)''')
-    conn.commit()
-    conn.close()
-    
-    # Garante migração de versões antigas
-    atualizar_banco_legado()
-
-def atualizar_banco_legado():
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    colunas_novas = {'usuario_responsavel': 'TEXT', 'detalhes': 'TEXT', 'paciente': 'TEXT', 'periodo': 'TEXT'}
-    for col, tipo in colunas_novas.items():
-        try: pd.read_sql(f'SELECT {col} FROM atendimentos LIMIT 1', conn)
-        except: 
-            try: c.execute(f'ALTER TABLE atendimentos ADD COLUMN {col} {tipo}'); conn.commit()
-            except: pass
-    conn.close()
-
-# --- LÓGICA DE PERÍODO ---
-def calcular_periodo(hora_inicio):
-    h = hora_inicio.hour
-    if 0 <= h < 6: return "Madrugada"
-    elif 6 <= h < 12: return "Manhã"
-    elif 12 <= h < 18: return "Tarde"
-    else: return "Noite"
-
-# --- PDF ---
-class PDF(FPDF):
-    def header(self):
-        self.set_fill_color(77, 166, 255)
-        self.rect(0, 0, 297, 25, 'F')
-        self.set_font('Arial', 'B', 15)
-        self.set_text_color(255, 255, 255)
-        self.cell(0, 10, 'Relatório de Atendimentos', 0, 1, 'C')
-        self.ln(5)
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.set_text_color(128, 128, 128)
-        self.cell(0, 10, f'Pagina {self.page_no()}', 0, 0, 'C')
-
-def criar_pdf_relatorio(df, mes_nome, ano, metricas, usuario, filtro_funcao):
-    pdf = PDF('L', 'mm', 'A4')
-    pdf.add_page()
-    
-    pdf.set_font('Arial', 'B', 12)
-    pdf.set_text_color(0, 0, 0)
-    pdf.cell(0, 10, f'Periodo: {mes_nome}/{ano} - Resp: {usuario}', 0, 1, 'L')
-    
-    pdf.set_fill_color(240, 240, 240)
-    pdf.rect(10, 35, 277, 20, 'F')
-    pdf.set_y(40)
-    pdf.set_font('Arial', '', 11)
-    pdf.cell(0, 10, f"Faturamento: R$ {metricas['valor']:,.2f}   Horas: {metricas['horas']:.1f} h   Qtd: {metricas['qtd']}", 0, 1, 'C')
-    pdf.ln(15)
-    
-    col_widths = [10, 28, 28, 40, 22, 30, 50, 25, 35] 
-    headers = ['ID', 'Inicio', 'Termino', 'Paciente', 'Periodo', 'Funcao', 'Detalhes', 'Valor', 'Resp.']
-    pdf.set_font('Arial', 'B', 8)
-    pdf.set_fill_color(200, 220, 255)
-    for i, h in enumerate(headers): pdf.cell(col_widths[i], 10, h, 1, 0, 'C', 1)
-    pdf.ln()
-    
-    pdf.set_font('Arial', '', 7)
-    fill = False
-    
-    for index, row in df.iterrows():
-        def clean(txt): return str(txt).encode('latin-1', 'replace').decode('latin-1')
-        pdf.set_fill_color(245, 245, 245)
-        
-        det = str(row['detalhes']) if row['detalhes'] is not None else ""
-        det_clean = clean(det)
-        if len(det_clean) > 30: det_clean = det_clean[:30] + "..."
-        
-        str_inicio = row['inicio'].strftime('%d/%m %H:%M')
-        str_termino = row['termino'].strftime('%d/%m %H:%M')
-
-        pdf.cell(col_widths[0], 8, str(row['id']), 1, 0, 'C', fill)
-        pdf.cell(col_widths[1], 8, str_inicio, 1, 0, 'C', fill)
-        pdf.cell(col_widths[2], 8, str_termino, 1, 0, 'C', fill)
-        pdf.cell(col_widths[3], 8, clean(row['paciente'])[:22], 1, 0, 'L', fill)
-        pdf.cell(col_widths[4], 8, clean(row['periodo']), 1, 0, 'C', fill)
-        pdf.cell(col_widths[5], 8, clean(row['funcao'])[:20], 1, 0, 'L', fill)
-        pdf.cell(col_widths[6], 8, det_clean, 1, 0, 'L', fill)
-        pdf.cell(col_widths[7], 8, f"{row['valor_total']:,.2f}", 1, 0, 'R', fill)
-        pdf.cell(col_widths[8], 8, clean(row['usuario_responsavel']), 1, 0, 'L', fill)
-        pdf.ln()
-        fill = not fill
-        
-    return pdf.output(dest='S').encode('latin-1')
-
-# --- CRUD BANCO DE DADOS ---
-def login_user(username, password):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM usuarios WHERE username = ?', (username,))
-    data = c.fetchall()
-    conn.close()
-    if data and check_hashes(password, data[0][1]): return data[0][2]
-    return False
-
-def criar_usuario(username, password, tipo):
-    try:
-        conn = sqlite3.connect('atendimentos.db')
-        c = conn.cursor()
-        c.execute('INSERT INTO usuarios VALUES (?, ?, ?)', (username, make_hashes(password), tipo))
-        conn.commit(); conn.close()
-        return True
-    except: return False
-
-def listar_usuarios():
-    conn = sqlite3.connect('atendimentos.db')
-    df = pd.read_sql('SELECT username, tipo FROM usuarios', conn)
-    conn.close()
-    return df
-
-def excluir_usuario(username):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM usuarios WHERE username = ?', (username,))
-    conn.commit(); conn.close()
+# --- RÓTULOS ---
+def rotular_atendimentos(df, formato_data='%d/%m'):
+    return ("ID " + df['id'].astype(str) + " | " + df['inicio'].dt.strftime(formato_data) + " | "
+            + df['paciente'].astype(str) + " | " + df['funcao'].astype(str))
 
-def carregar_funcoes():
-    conn = sqlite3.connect('atendimentos.db')
-    df = pd.read_sql('SELECT * FROM funcoes', conn)
-    conn.close()
-    return df
-
-def salvar_funcao(nome, valor):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO funcoes (nome, valor_hora) VALUES (?, ?)', (nome, valor))
-    conn.commit(); conn.close()
-
-def atualizar_funcao_db(id_func, nome, valor):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('UPDATE funcoes SET nome=?, valor_hora=? WHERE id=?', (nome, valor, id_func))
-    conn.commit(); conn.close()
-
-def excluir_funcao_db(id_func):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM funcoes WHERE id=?', (id_func,))
-    conn.commit(); conn.close()
-
-def salvar_atendimento(inicio, termino, funcao, valor_total, usuario, detalhes, paciente, periodo):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO atendimentos (inicio, termino, funcao, valor_total, usuario_responsavel, detalhes, paciente, periodo) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', (inicio, termino, funcao, valor_total, usuario, detalhes, paciente, periodo))
-    conn.commit(); conn.close()
-
-def atualizar_atendimento_db(id_atend, inicio, termino, funcao, valor_total, detalhes, paciente, periodo):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('''UPDATE atendimentos 
-                 SET inicio=?, termino=?, funcao=?, valor_total=?, detalhes=?, paciente=?, periodo=?
-                 WHERE id=?''', 
-              (inicio, termino, funcao, valor_total, detalhes, paciente, periodo, id_atend))
-    conn.commit(); conn.close()
-
-def excluir_atendimento_db(id_atend):
-    conn = sqlite3.connect('atendimentos.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM atendimentos WHERE id=?', (id_atend,))
-    conn.commit(); conn.close()
-
-def carregar_atendimentos():
-    conn = sqlite3.connect('atendimentos.db')
-    try:
-        if st.session_state.get('tipo') == 'admin':
-            query = 'SELECT * FROM atendimentos'
-            df = pd.read_sql(query, conn)
-        else:
-            query = 'SELECT * FROM atendimentos WHERE usuario_responsavel = ?'
-            df = pd.read_sql(query, conn, params=(st.session_state.get('usuario'),))
-    except Exception as e:
-        df = pd.DataFrame()
-    finally:
-        conn.close()
-    
-    if not df.empty:
-        df['inicio'] = pd.to_datetime(df['inicio'])
-        df['termino'] = pd.to_datetime(df['termino'])
-        for col in ['usuario_responsavel', 'detalhes', 'paciente', 'periodo']:
-            if col not in df.columns: df[col] = ''
-            df[col] = df[col].fillna('')
-            
-    return df
-
-# Inicializa
-init_db()
+# --- LEITURAS ---
+def ler_ou_parar(leitura, *args, **kwargs):
+    # Falha de leitura (ano arquivado ausente, banco ocupado): mensagem na tela e a página para aqui
+    try: return leitura(*args, **kwargs)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        st.error(f"❌ Não foi possível carregar os atendimentos: {e}")
+        st.stop()
 
 # --- SESSÃO ---
 if 'logado' not in st.session_state:
@@ -262,6 +51,7 @@ if 'logado' not in st.session_state:
 
 # --- LOGIN ---
 if not st.session_state['logado']:
+    tela = desempenho.iniciar_tela('tela:Login')
     st.markdown("<br><br>", unsafe_allow_html=True)
     col1, col2, col3 = st.columns([1, 1.5, 1])
     with col2:
@@ -271,14 +61,27 @@ if not st.session_state['logado']:
             usuario = st.text_input("👤 Usuário")
             senha = st.text_input("🔑 Senha", type="password")
             if st.form_submit_button("🚀 Entrar"):
-                tipo = login_user(usuario, senha)
-                if tipo:
-                    st.session_state.update({'logado': True, 'usuario': usuario, 'tipo': tipo})
+                banco.inicializar()  # migrações rodam só na primeira execução do processo
+                acesso = autenticar(usuario, senha)
+                if acesso:
+                    st.session_state.update({'logado': True, 'usuario': acesso.usuario, 'tipo': acesso.tipo})
                     st.rerun()
                 else: st.error("Acesso negado.")
 
 # --- SISTEMA ---
 else:
+    # Pandas e relatórios só entram depois do login (a tela de login não precisa deles)
+    import pandas as pd
+    import cache
+    from servico import (calcular_periodo, intervalo_mes, criar_usuario, listar_usuarios, excluir_usuario, carregar_funcoes,
+                         salvar_funcao, atualizar_funcao, excluir_funcao, reprecificar_atendimentos, salvar_atendimento,
+                         atualizar_atendimento, excluir_atendimento, carregar_atendimentos, buscar_atendimentos, listar_anos,
+                         listar_distintos, carregar_metricas, carregar_tendencia, reconstruir_resumo, listar_arquivos,
+                         arquivar_ano, importar_atendimentos, auditar_conflitos, exportar_atendimentos)
+    from relatorios import (MESES, FORMATOS_EXPORTACAO, criar_pdf_relatorio, criar_excel_relatorio, exportar_lotes,
+                            ler_e_apagar)
+    banco.inicializar()
+    acesso = Acesso(st.session_state['usuario'], st.session_state['tipo'])
     st.sidebar.title("Menu")
     st.sidebar.markdown(f"👤 **{st.session_state['usuario']}**")
     st.sidebar.caption(f"Acesso: {st.session_state['tipo'].upper()}")
@@ -288,12 +91,15 @@ else:
         "Atendimento": "📝 Novo Atendimento",
         "Gerenciar": "✏️ Gerenciar (Editar/Excluir)",
         "Relatorios": "📊 Relatórios",
+        "Analises": "🧮 Análises",
         "Admin": "⚙️ Administração"
     }
     
-    lista_menu = [opcoes_menu["Funções"], opcoes_menu["Atendimento"], opcoes_menu["Gerenciar"], opcoes_menu["Relatorios"]]
+    lista_menu = [opcoes_menu["Funções"], opcoes_menu["Atendimento"], opcoes_menu["Gerenciar"], opcoes_menu["Relatorios"],
+                  opcoes_menu["Analises"]]
     if st.session_state['tipo'] == 'admin': lista_menu.append(opcoes_menu["Admin"])
     menu = st.sidebar.radio("Navegue por aqui:", lista_menu)
+    tela = desempenho.iniciar_tela('tela:' + next(k for k, v in opcoes_menu.items() if v == menu))
     st.sidebar.markdown("---")
     if st.sidebar.button("🚪 Sair"):
         st.session_state.update({'logado': False, 'usuario': None, 'tipo': None})
@@ -336,20 +142,27 @@ else:
                         ce1, ce2 = st.columns([2, 1])
                         novo_nome_f = ce1.text_input("Nome", value=row_f['nome'])
                         novo_valor_f = ce2.number_input("Valor Hora", value=row_f['valor_hora'], format="%.2f")
-                        
+                        reprecificar = False
+                        if acesso.tipo == 'admin':
+                            cr1, cr2 = st.columns([2, 1])
+                            reprecificar = cr1.checkbox("💲 Recalcular o valor dos atendimentos desta função com início a partir de")
+                            reprecificar_desde = cr2.date_input("Recalcular desde", value=datetime.now().date().replace(day=1),
+                                                                label_visibility="collapsed")
+
                         col_save_f, col_del_f = st.columns(2)
                         btn_save_f = col_save_f.form_submit_button("💾 Atualizar Dados")
                         delete_check = col_del_f.checkbox("🗑️ Confirmar Exclusão")
                         btn_del_f = col_del_f.form_submit_button("Excluir Função")
 
                         if btn_save_f:
-                            atualizar_funcao_db(id_func_sel, novo_nome_f, novo_valor_f)
+                            atualizar_funcao(id_func_sel, novo_nome_f, novo_valor_f)
+                            if reprecificar: reprecificar_atendimentos(acesso, id_func_sel, reprecificar_desde)
                             st.success("Função atualizada!")
                             st.rerun()
                         
                         if btn_del_f:
                             if delete_check:
-                                excluir_funcao_db(id_func_sel)
+                                excluir_funcao(id_func_sel)
                                 st.warning("Função excluída!")
                                 st.rerun()
                             else:
@@ -380,40 +193,48 @@ else:
                 if st.button("✅ Salvar Atendimento"):
                     dt_ini = datetime.combine(d_ini, h_ini)
                     dt_fim = datetime.combine(d_fim, h_fim)
-                    if not nome_paciente: st.error("❌ Nome do paciente obrigatório.")
-                    elif dt_fim <= dt_ini: st.error("❌ Erro: Término deve ser depois do início.")
-                    else:
-                        duracao = (dt_fim - dt_ini).total_seconds() / 3600
-                        val_h = df_func.loc[df_func['nome'] == func, 'valor_hora'].values[0]
-                        total = duracao * val_h
-                        salvar_atendimento(dt_ini, dt_fim, func, total, st.session_state['usuario'], detalhes, nome_paciente, periodo_auto)
-                        st.success(f"✅ Salvo! Total: **R$ {total:,.2f}**")
+                    try:
+                        _, total = salvar_atendimento(acesso, dt_ini, dt_fim, func, nome_paciente, detalhes)
+                    except (ValueError, TimeoutError) as e: st.error(f"❌ {e}")
+                    else: st.success(f"✅ Salvo! Total: **R$ {total:,.2f}**")
 
     # TELA 03: GERENCIAR
     elif menu == opcoes_menu["Gerenciar"]:
         st.title("✏️ Gerenciar Registros")
         
-        df = carregar_atendimentos()
+        anos = listar_anos(acesso)
         df_func = carregar_funcoes()
         
-        if df.empty:
+        if not anos:
             st.info("Nenhum registro encontrado para editar.")
         else:
             st.markdown("### 1. Selecione o Registro")
-            col_f1, col_f2 = st.columns(2)
-            anos = sorted(df['inicio'].dt.year.unique())
-            f_ano_edit = col_f1.selectbox("Filtrar Ano", anos, index=len(anos)-1, key="edit_ano")
-            f_mes_edit = col_f2.selectbox("Filtrar Mês", range(1,13), index=datetime.now().month-1, key="edit_mes")
-            
-            df_edit_fil = df[(df['inicio'].dt.year == f_ano_edit) & (df['inicio'].dt.month == f_mes_edit)]
+            busca = st.text_input("🔎 Buscar por paciente ou detalhes (todos os anos)", key="edit_busca", placeholder="Ex.: maria silva, curativo")
+            if busca.strip():
+                # Pilha de cursores: um por página já visitada (a primeira começa do mais recente)
+                if st.session_state.get('busca_termo') != busca:
+                    st.session_state.update({'busca_termo': busca, 'busca_cursores': [None]})
+                cursores = st.session_state['busca_cursores']
+                df_edit_fil, proximo = ler_ou_parar(buscar_atendimentos, acesso, busca, apos=cursores[-1])
+                col_p1, col_p2, col_p3 = st.columns([1, 2, 1])
+                col_p2.caption(f"Página {len(cursores)}")
+                if col_p1.button("⬅️ Anterior", disabled=len(cursores) == 1): cursores.pop(); st.rerun()
+                if col_p3.button("Próxima ➡️", disabled=proximo is None): cursores.append(proximo); st.rerun()
+                msg_vazio, formato_data = "Nenhum registro encontrado para a busca.", '%d/%m/%Y'
+            else:
+                col_f1, col_f2 = st.columns(2)
+                f_ano_edit = col_f1.selectbox("Filtrar Ano", anos, index=len(anos)-1, key="edit_ano")
+                f_mes_edit = col_f2.selectbox("Filtrar Mês", range(1,13), index=datetime.now().month-1, key="edit_mes")
+                df_edit_fil = ler_ou_parar(carregar_atendimentos, acesso, *intervalo_mes(f_ano_edit, f_mes_edit))
+                msg_vazio, formato_data = "Nenhum registro neste mês.", '%d/%m'
             
             if df_edit_fil.empty:
-                st.warning("Nenhum registro neste mês.")
+                st.warning(msg_vazio)
             else:
-                opcoes_edit = df_edit_fil.apply(lambda x: f"ID {x['id']} | {x['inicio'].strftime('%d/%m')} | {x['paciente']} | {x['funcao']}", axis=1)
+                opcoes_edit = rotular_atendimentos(df_edit_fil, formato_data)
                 registro_selecionado_str = st.selectbox("Escolha o atendimento para editar:", options=opcoes_edit)
                 id_selecionado = int(registro_selecionado_str.split(" | ")[0].replace("ID ", ""))
-                row = df[df['id'] == id_selecionado].iloc[0]
+                row = df_edit_fil[df_edit_fil['id'] == id_selecionado].iloc[0]
                 
                 st.divider()
                 # AQUI ESTAVA O PROBLEMA: Substituído por st.warning nativo
@@ -441,13 +262,10 @@ else:
                 if btn_save:
                     dt_ini = datetime.combine(novo_d_ini, novo_h_ini)
                     dt_fim = datetime.combine(novo_d_fim, novo_h_fim)
-                    if dt_fim <= dt_ini: st.error("Erro: Data fim menor que início.")
+                    try:
+                        atualizar_atendimento(acesso, id_selecionado, dt_ini, dt_fim, nova_funcao, novo_paciente, novos_detalhes)
+                    except (ValueError, LookupError, TimeoutError) as e: st.error(f"Erro: {e}")
                     else:
-                        duracao = (dt_fim - dt_ini).total_seconds() / 3600
-                        val_h = df_func.loc[df_func['nome'] == nova_funcao, 'valor_hora'].values[0]
-                        novo_total = duracao * val_h
-                        novo_periodo = calcular_periodo(novo_h_ini)
-                        atualizar_atendimento_db(id_selecionado, dt_ini, dt_fim, nova_funcao, novo_total, novos_detalhes, novo_paciente, novo_periodo)
                         st.success("Registro atualizado com sucesso!")
                         st.rerun()
 
@@ -455,42 +273,39 @@ else:
                 with st.expander("🗑️ Área de Perigo (Excluir Registro)"):
                     st.warning(f"Tem certeza que deseja excluir ID {id_selecionado}?")
                     if st.button("Sim, Excluir Permanentemente", key="btn_excluir"):
-                        excluir_atendimento_db(id_selecionado)
-                        st.error("Registro excluído.")
-                        st.rerun()
+                        try: excluir_atendimento(acesso, id_selecionado)
+                        except (LookupError, TimeoutError) as e: st.error(f"Erro: {e}")
+                        else:
+                            st.error("Registro excluído.")
+                            st.rerun()
 
     # TELA 04: RELATÓRIOS
     elif menu == opcoes_menu["Relatorios"]:
         st.title("📊 Relatórios Gerenciais")
         if st.session_state['tipo'] != 'admin': st.info(f"🔒 Dados de: **{st.session_state['usuario']}**")
         else: st.success("🔓 Modo Admin: Visualizando TUDO.")
-        df = carregar_atendimentos()
-        if not df.empty:
-            anos = sorted(df['inicio'].dt.year.unique())
-            meses_dict = {1:"Janeiro", 2:"Fevereiro", 3:"Marco", 4:"Abril", 5:"Maio", 6:"Junho",
-                          7:"Julho", 8:"Agosto", 9:"Setembro", 10:"Outubro", 11:"Novembro", 12:"Dezembro"}
+        anos = listar_anos(acesso)
+        if anos:
+            meses_dict = MESES
             with st.container(border=True):
                 if st.session_state['tipo'] == 'admin': c1, c2, c3, c4 = st.columns(4)
                 else: c1, c2, c3 = st.columns(3); c4 = None
                 f_ano = c1.selectbox("📅 Ano", anos, index=len(anos)-1)
                 f_mes = c2.selectbox("🗓️ Mês", range(1,13), format_func=lambda x: meses_dict[x], index=datetime.now().month-1)
-                opcoes_funcoes = ['Todas'] + sorted(df['funcao'].unique().tolist())
+                opcoes_funcoes = ['Todas'] + listar_distintos(acesso, 'funcao')
                 f_funcao = c3.selectbox("💼 Função", opcoes_funcoes)
                 f_usuario = 'Todos'
                 if st.session_state['tipo'] == 'admin':
-                    lista_users = ['Todos'] + sorted(df['usuario_responsavel'].astype(str).unique().tolist())
+                    lista_users = ['Todos'] + listar_distintos(acesso, 'usuario_responsavel')
                     f_usuario = c4.selectbox("👤 Usuário", lista_users)
             
-            df_fil = df[(df['inicio'].dt.year == f_ano) & (df['inicio'].dt.month == f_mes)]
-            if f_funcao != 'Todas': df_fil = df_fil[df_fil['funcao'] == f_funcao]
-            if st.session_state['tipo'] == 'admin' and f_usuario != 'Todos':
-                df_fil = df_fil[df_fil['usuario_responsavel'] == f_usuario]
+            filtro_funcao = None if f_funcao == 'Todas' else f_funcao
+            filtro_usuario = None if f_usuario == 'Todos' else f_usuario
+            df_fil = ler_ou_parar(carregar_atendimentos, acesso, *intervalo_mes(f_ano, f_mes), funcao=filtro_funcao, usuario=filtro_usuario)
             
             if not df_fil.empty:
-                total_val = df_fil['valor_total'].sum()
-                total_horas = (df_fil['termino']-df_fil['inicio']).dt.total_seconds().sum()/3600
-                total_qtd = len(df_fil)
-                metricas = {'valor': total_val, 'horas': total_horas, 'qtd': total_qtd}
+                metricas = carregar_metricas(acesso, f_ano, f_mes, filtro_funcao, filtro_usuario)
+                total_val, total_horas, total_qtd = metricas['valor'], metricas['horas'], metricas['qtd']
                 st.markdown(f"### 📈 Resumo: {meses_dict[f_mes]} / {f_ano}")
                 k1, k2, k3 = st.columns(3)
                 k1.metric("💰 Faturamento", f"R$ {total_val:,.2f}")
@@ -508,16 +323,91 @@ else:
                 df_display = df_display[cols]
                 df_display.columns = ['ID', 'Início', 'Término', 'Paciente', 'Período', 'Função', 'Detalhes', 'Valor', 'Resp.']
                 st.dataframe(df_display, use_container_width=True, hide_index=True)
+                with st.expander("📉 Tendência (últimos 12 meses)"):
+                    df_tend = carregar_tendencia(acesso, f_ano, f_mes, filtro_funcao, filtro_usuario)
+                    df_tend.index = [f"{a}-{m:02d}" for a, m in zip(df_tend['ano'], df_tend['mes'])]
+                    st.bar_chart(df_tend['valor'])
+                    st.dataframe(df_tend[['valor', 'horas', 'qtd']], use_container_width=True)
                 col_d1, col_d2 = st.columns(2)
-                buffer_excel = io.BytesIO()
-                with pd.ExcelWriter(buffer_excel, engine='xlsxwriter') as writer: df_fil.to_excel(writer, index=False)
-                col_d1.download_button("📥 Baixar Excel", buffer_excel.getvalue(), f"Relatorio_{meses_dict[f_mes]}.xlsx", use_container_width=True)
-                
-                pdf_bytes = criar_pdf_relatorio(df_fil, meses_dict[f_mes], f_ano, metricas, st.session_state['usuario'], f_funcao)
-                col_d2.download_button("📄 Baixar PDF", pdf_bytes, f"Relatorio_{meses_dict[f_mes]}.pdf", mime='application/pdf', use_container_width=True)
+                # Arquivos só são gerados no clique (em outra thread) e ficam em cache pelo filtro
+                usuario_atual = st.session_state['usuario']
+                chave_export = (f_ano, f_mes, filtro_funcao, filtro_usuario, st.session_state['tipo'], usuario_atual)
+                geracao = cache.exportacoes.geracao
+                gerar_excel = lambda: cache.exportacoes.obter(('xlsx',) + chave_export, lambda: criar_excel_relatorio(df_fil), geracao)
+                gerar_pdf = lambda: cache.exportacoes.obter(('pdf',) + chave_export, lambda: criar_pdf_relatorio(
+                    df_fil, meses_dict[f_mes], f_ano, metricas, usuario_atual, f_funcao), geracao)
+                col_d1.download_button("📥 Baixar Excel", gerar_excel, f"Relatorio_{meses_dict[f_mes]}.xlsx", use_container_width=True)
+                col_d2.download_button("📄 Baixar PDF", gerar_pdf, f"Relatorio_{meses_dict[f_mes]}.pdf", mime='application/pdf', use_container_width=True)
             else: st.info("Sem dados.")
+            with st.expander("📦 Exportar Período Longo"):
+                st.caption("Lê do banco em lotes e grava direto no arquivo (Excel em modo de memória constante ou CSV "
+                           "comprimido), sem montar a planilha inteira na memória. Usa os filtros de função e usuário acima.")
+                e1, e2 = st.columns([2, 1])
+                periodo_exp = e1.date_input("Período", (date(f_ano, 1, 1), date(f_ano, 12, 31)), format="DD/MM/YYYY",
+                                            key="periodo_exportacao")
+                formato_exp = e2.radio("Formato", list(FORMATOS_EXPORTACAO), horizontal=True,
+                                       format_func={'xlsx': 'Excel', 'csv.gz': 'CSV (gzip)'}.get)
+                if len(periodo_exp) == 2:
+                    ini_exp = datetime.combine(periodo_exp[0], time())
+                    fim_exp = datetime.combine(periodo_exp[1] + timedelta(days=1), time())
+                    sufixo_exp, mime_exp = FORMATOS_EXPORTACAO[formato_exp]
+                    gerar_exportacao = lambda: ler_e_apagar(exportar_lotes(
+                        *exportar_atendimentos(acesso, ini_exp, fim_exp, filtro_funcao, filtro_usuario), formato_exp))
+                    st.download_button("📦 Baixar Arquivo", gerar_exportacao,
+                                       f"Atendimentos_{periodo_exp[0]:%Y%m%d}_{periodo_exp[1]:%Y%m%d}{sufixo_exp}", mime=mime_exp)
         else: st.info("Sem registros.")
 
+    # TELA 05: ANÁLISES
+    elif menu == opcoes_menu["Analises"]:
+        st.title("🧮 Análises")
+        # Lê só o instantâneo Parquet (analitico.py): nada aqui consulta o banco do dia a dia.
+        # Importado só nesta tela: as outras não precisam carregar o pyarrow.parquet
+        import analitico
+        if st.session_state['tipo'] == 'admin':
+            c1, c2 = st.columns([3, 1])
+            if c2.button("🔄 Atualizar Instantâneo", use_container_width=True,
+                         help="Relê do banco só os atendimentos incluídos, alterados ou excluídos desde a última atualização."):
+                r = analitico.atualizar_instantaneo(acesso)
+                st.toast(f"✅ {r['alteradas']} atendimentos relidos ({r['modo']}).")
+        else: c1 = st.container(); st.info(f"🔒 Dados de: **{st.session_state['usuario']}**")
+        info = analitico.informacoes()
+        if info is None:
+            st.info("Instantâneo analítico ainda não gerado" + (": clique em Atualizar Instantâneo." if st.session_state['tipo'] == 'admin' else "."))
+        else:
+            c1.caption(f"Dados de {info['gerado_em'].strftime('%d/%m/%Y %H:%M')} — {info['linhas']} atendimentos "
+                       f"({info['bytes'] / 1024 / 1024:.1f} MB). Alterações posteriores entram na próxima atualização.")
+            with st.container(border=True):
+                c1, c2, c3, c4 = st.columns(4)
+                hoje = date.today()
+                intervalo = c1.date_input("📅 Período", (date(hoje.year, 1, 1), hoje), format="DD/MM/YYYY")
+                dimensoes = list(analitico.DIMENSOES)
+                a_linhas = c2.selectbox("Linhas", dimensoes, format_func=analitico.DIMENSOES.get)
+                a_colunas = c3.selectbox("Colunas", [None] + dimensoes, index=dimensoes.index('mes') + 1,
+                                         format_func=lambda d: 'Nenhuma' if d is None else analitico.DIMENSOES[d])
+                a_medida = c4.selectbox("Medida", list(analitico.MEDIDAS), format_func=analitico.MEDIDAS.get)
+                c5, c6 = st.columns(2)
+                a_funcao = c5.selectbox("💼 Função", ['Todas'] + analitico.distintos(acesso, 'funcao'))
+                a_usuario = 'Todos'
+                if st.session_state['tipo'] == 'admin':
+                    a_usuario = c6.selectbox("👤 Usuário", ['Todos'] + analitico.distintos(acesso, 'usuario_responsavel'))
+            if len(intervalo) == 2:
+                a_inicio, a_fim = datetime.combine(intervalo[0], time()), datetime.combine(intervalo[1] + timedelta(days=1), time())
+                filtros = dict(funcao=None if a_funcao == 'Todas' else a_funcao, usuario=None if a_usuario == 'Todos' else a_usuario)
+                totais = analitico.resumir(acesso, a_inicio, a_fim, **filtros)
+                if totais['qtd']:
+                    k1, k2, k3 = st.columns(3)
+                    k1.metric("💰 Faturamento", f"R$ {totais['valor']:,.2f}")
+                    k2.metric("⏱️ Horas Totais", f"{totais['horas']:.1f} h")
+                    k3.metric("📂 Atendimentos", totais['qtd'])
+                    tabela = analitico.analisar(acesso, a_inicio, a_fim, a_linhas, a_colunas, a_medida, **filtros)
+                    st.bar_chart(tabela.iloc[:-1, -1])
+                    formato = "%d" if a_medida == 'qtd' else "%.1f" if a_medida == 'horas' else "R$ %.2f"
+                    st.dataframe(tabela, use_container_width=True,
+                                 column_config={c: st.column_config.NumberColumn(format=formato) for c in tabela.columns})
+                    st.download_button("📥 Baixar Tabela (CSV)", tabela.to_csv(sep=';', decimal=',').encode('utf-8-sig'),
+                                       f"Analise_{a_linhas}_{a_colunas or 'total'}.csv", mime='text/csv')
+                else: st.info("Sem dados no período.")
+
     # TELA ADMIN
     elif menu == opcoes_menu["Admin"]:
         st.title("⚙️ Administração")
@@ -526,11 +416,96 @@ else:
                 u = st.text_input("Login"); p = st.text_input("Senha", type="password"); t = st.selectbox("Nível", ["comum", "admin"])
                 if st.form_submit_button("Criar"):
                     if u and p: 
-                        if criar_usuario(u, p, t): st.success("✅ Criado!")
+                        if criar_usuario(acesso, u, p, t): st.success("✅ Criado!")
                         else: st.error("❌ Erro.")
+        with st.expander("📥 Importar Atendimentos (CSV/Excel)"):
+            st.caption("Colunas: inicio, termino, funcao, paciente e, opcionalmente, detalhes e usuario_responsavel. "
+                       "Valor e período são recalculados a partir das funções cadastradas.")
+            arquivo = st.file_uploader("Arquivo", type=['csv', 'xlsx'])
+            usuarios_imp = listar_usuarios(acesso)['username'].tolist()
+            resp_padrao = st.selectbox("Responsável (quando a coluna vier vazia)", usuarios_imp,
+                                       index=usuarios_imp.index(st.session_state['usuario']) if st.session_state['usuario'] in usuarios_imp else 0)
+            tudo_ou_nada = st.checkbox("Importar somente se não houver erros")
+            if arquivo is not None and st.button("📥 Importar"):
+                try:
+                    qtd, df_erros = importar_atendimentos(acesso, arquivo, arquivo.name, resp_padrao, tudo_ou_nada)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    if qtd: st.success(f"✅ {qtd} atendimentos importados.")
+                    if not df_erros.empty:
+                        st.warning(f"⚠️ {len(df_erros)} linhas rejeitadas" + (" — nada foi importado." if not qtd else "."))
+                        st.dataframe(df_erros, hide_index=True, use_container_width=True)
+                        st.download_button("📄 Baixar relatório de erros", df_erros.to_csv(index=False).encode('utf-8-sig'),
+                                           "erros_importacao.csv", mime='text/csv')
         st.subheader("👥 Usuários")
-        for i, row in listar_usuarios().iterrows():
+        for i, row in listar_usuarios(acesso).iterrows():
             c1, c2, c3 = st.columns([3, 2, 1])
             c1.markdown(f"👤 **{row['username']}**"); c2.caption(f"Tipo: {row['tipo']}")
             if row['username'] != 'admin':
-                if c3.button("🗑️", key=f"del_{row['username']}"): excluir_usuario(row['username']); st.rerun()
\ No newline at end of file
+                if c3.button("🗑️", key=f"del_{row['username']}"): excluir_usuario(acesso, row['username']); st.rerun()
+        
+        st.subheader("⚡ Cache de Leituras")
+        est = cache.leituras.estatisticas()
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("✅ Acertos", est['acertos'])
+        k2.metric("❌ Falhas", est['falhas'])
+        k3.metric("🎯 Taxa de Acerto", f"{est['taxa_acerto']:.0%}")
+        k4.metric("📦 Itens", f"{est['itens']} / {est['max_itens']}")
+        st.caption(f"Geração dos dados: {est['geracao']} — Despejos: {est['despejos']}")
+        est_exp = cache.exportacoes.estatisticas()
+        st.caption(f"Exportações em cache: {est_exp['itens']} arquivos, {est_exp['bytes'] / 1024 / 1024:.1f} de "
+                   f"{est_exp['max_bytes'] / 1024 / 1024:.0f} MB — Acertos: {est_exp['acertos']} — Falhas: {est_exp['falhas']}")
+        if st.button("🧹 Limpar Cache"): cache.invalidar(); st.rerun()
+        
+        st.subheader("📊 Resumo Mensal")
+        st.caption("Os KPIs de Relatórios vêm da tabela resumo_mensal, mantida automaticamente a cada gravação.")
+        if st.button("🔄 Reconstruir Resumo Mensal"):
+            reconstruir_resumo(acesso)
+            st.success("✅ Resumo reconstruído a partir dos atendimentos.")
+
+        st.subheader("🗄️ Arquivo por Ano")
+        st.caption("Anos encerrados saem do banco principal para um arquivo próprio (atendimentos_AAAA.db) e continuam "
+                   "disponíveis, somente leitura, em Gerenciar e Relatórios.")
+        df_arq = listar_arquivos(acesso)
+        if not df_arq.empty: st.dataframe(df_arq, hide_index=True, use_container_width=True)
+        fechados = [a for a in listar_anos(acesso) if a < datetime.now().year]
+        if fechados:
+            ca1, ca2, ca3 = st.columns([1, 2, 1])
+            ano_arq = ca1.selectbox("Ano a arquivar", fechados, label_visibility="collapsed")
+            compactar_arq = ca2.checkbox("Compactar o banco principal (VACUUM) depois")
+            if ca3.button("🗄️ Arquivar Ano"):
+                qtd = arquivar_ano(acesso, ano_arq, compactar_arq)
+                st.success(f"✅ {qtd} atendimentos de {ano_arq} arquivados.")
+        else: st.info("Nenhum ano encerrado para arquivar.")
+
+        st.subheader("⏱️ Conflitos de Horário")
+        st.caption("Atendimentos novos ou editados que cruzam outro do mesmo profissional são recusados. "
+                   "A auditoria procura as sobreposições já gravadas no banco principal.")
+        if st.button("🔍 Auditar Conflitos"):
+            df_conf = auditar_conflitos(acesso)
+            if df_conf.empty: st.success("✅ Nenhuma sobreposição encontrada.")
+            else:
+                st.warning(f"⚠️ {len(df_conf)} pares sobrepostos em {df_conf['usuario_responsavel'].nunique()} profissionais.")
+                st.dataframe(df_conf, hide_index=True, use_container_width=True)
+                st.download_button("📄 Baixar auditoria", df_conf.to_csv(index=False).encode('utf-8-sig'),
+                                   "conflitos_horario.csv", mime='text/csv')
+
+        st.subheader("📈 Desempenho")
+        ligado = st.toggle("Instrumentação ativa", value=desempenho.ativo(),
+                           help="Mede tempo, consultas SQL e linhas de cada função de banco e de cada tela. "
+                                "Desligada, o custo é praticamente zero.")
+        if ligado != desempenho.ativo(): desempenho.ativar(ligado); st.rerun()
+        resumo_desempenho = pd.DataFrame(desempenho.resumo())
+        if not resumo_desempenho.empty:
+            st.caption(f"Últimos {resumo_desempenho['chamadas'].sum()} eventos "
+                       f"(buffer de {desempenho.TAMANHO_BUFFER}); percentis de latência em ms.")
+            st.dataframe(resumo_desempenho, hide_index=True, use_container_width=True,
+                         column_config={c: st.column_config.NumberColumn(format="%.1f") for c in ['p50_ms', 'p95_ms', 'p99_ms', 'max_ms']})
+            c1, c2 = st.columns(2)
+            c1.download_button("📄 Exportar eventos (JSON Lines)", lambda: desempenho.exportar_jsonl().encode('utf-8'),
+                               "desempenho.jsonl", mime='application/x-ndjson')
+            if c2.button("🧹 Limpar Eventos"): desempenho.limpar(); st.rerun()
+        elif ligado: st.info("Nenhum evento registrado ainda.")
+
+desempenho.finalizar_tela(tela)
\ No newline at end of file
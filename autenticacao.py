@@ -0,0 +1,30 @@
+import hashlib
+from collections import namedtuple
+
+import banco
+import desempenho
+
+# --- AUTENTICAÇÃO ---
+# Tudo o que a tela de login usa, sem pandas nem geradores de relatório: o app importa o
+# servico.py (e o resto) só depois do login, então a primeira tela sai sem esse custo.
+Acesso = namedtuple('Acesso', ['usuario', 'tipo'])  # tipo: 'admin' ou 'comum'
+
+
+# --- FUNÇÕES DE SEGURANÇA ---
+def make_hashes(password):
+    return hashlib.sha256(str.encode(password)).hexdigest()
+
+def check_hashes(password, hashed_text):
+    if make_hashes(password) == hashed_text:
+        return True
+    return False
+
+
+# --- LOGIN ---
+@desempenho.instrumentar
+def autenticar(username, password):
+    # Devolve o Acesso do usuário ou None se login/senha não conferem. Uma única consulta pela
+    # chave primária; o sqlite3 guarda o comando preparado entre as chamadas.
+    row = banco.leitura().execute('SELECT password, tipo FROM usuarios WHERE username = ?', (username,)).fetchone()
+    if row and check_hashes(password, row[0]): return Acesso(username, row[1])
+    return None
@@ -0,0 +1,766 @@
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from time import monotonic
+
+# --- CONFIGURAÇÃO ---
+CAMINHO_PADRAO = 'atendimentos.db'
+TIMEOUT_OCUPADO = 30.0  # segundos aguardando o lock antes de "database is locked"
+TAMANHO_FILA = 256  # escritas aguardando o gravador; com a fila cheia, quem chega espera até o timeout
+JANELA_GRUPO_S = 0.002  # quanto o gravador espera por mais escritas antes de fechar o grupo
+MAX_GRUPO = 64  # escritas por transação do gravador
+MAX_LEITORES_LIVRES = 8  # conexões de leitura de threads encerradas guardadas para reuso
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=134217728',
+    'PRAGMA foreign_keys=ON',
+)
+
+
+# --- DATAS ---
+# inicio/termino são gravados como INTEGER: segundos desde 1970 do horário local
+# tratado como UTC (sem fuso), ou seja, o relógio de parede exato que foi digitado.
+EPOCH = datetime(1970, 1, 1)
+
+def para_epoch(valor):
+    if not isinstance(valor, datetime):
+        valor = datetime.combine(valor, time()) if isinstance(valor, date) else datetime.fromisoformat(str(valor))
+    return int((valor.replace(tzinfo=None) - EPOCH).total_seconds())
+
+def ano_epoch(segundos):
+    return (EPOCH + timedelta(seconds=segundos)).year
+
+
+# --- GERENCIADOR DE CONEXÕES ---
+# Uma instância por processo: conexões de leitura por thread (o WAL permite leitores
+# simultâneos ao escritor) e uma única conexão de escrita serializada por lock, de modo
+# que as sessões do Streamlit nunca disputam o lock de escrita do SQLite entre si.
+class Banco:
+    def __init__(self, caminho=CAMINHO_PADRAO, timeout=TIMEOUT_OCUPADO):
+        self.caminho = caminho
+        self.timeout = timeout
+        self._trava = threading.Lock()
+        self._leitores = {}  # ident da thread -> (thread, conexão)
+        self._livres = []  # conexões de leitura sem dono, já configuradas
+        self._sentinela = None  # conexão que nunca escreve, só para PRAGMA data_version
+        self._trava_sentinela = threading.Lock()
+        self._trava_escrita = threading.RLock()
+        self._escritor = None
+        self._profundidade = 0
+        self._dono = None  # ident da thread com a transação aberta
+        self._fila = queue.Queue(TAMANHO_FILA)
+        self._gravador = None
+        self._migrado = False
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.caminho, timeout=self.timeout,
+                               isolation_level=None, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if _rastreio is not None:
+            conn.set_trace_callback(_rastreio)
+        return conn
+
+    def leitura(self):
+        thread = threading.current_thread()
+        with self._trava:
+            item = self._leitores.get(thread.ident)
+            if item is not None and item[0] is thread:
+                return item[1]
+            # Cada rerun do Streamlit roda numa thread nova: as conexões das threads encerradas
+            # voltam para a lista de livres e são reaproveitadas, sem reconectar nem reaplicar PRAGMAs
+            for ident, (t, conn) in list(self._leitores.items()):
+                if not t.is_alive() or ident == thread.ident:
+                    del self._leitores[ident]
+                    if len(self._livres) < MAX_LEITORES_LIVRES: self._livres.append(conn)
+                    else: conn.close()
+            conn = self._livres.pop() if self._livres else self._conectar()
+            self._leitores[thread.ident] = (thread, conn)
+            return conn
+
+    @contextmanager
+    def transacao(self):
+        with self._trava_escrita:
+            if self._escritor is None:
+                self._escritor = self._conectar()
+            conn = self._escritor
+            if self._profundidade:
+                # Transação aninhada na mesma thread: participa da transação externa
+                self._profundidade += 1
+                try: yield conn
+                finally: self._profundidade -= 1
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            self._profundidade, self._dono = 1, threading.get_ident()
+            try:
+                yield conn
+            except BaseException:
+                self._desfazer(conn)
+                raise
+            else:
+                try:
+                    conn.commit()
+                except BaseException:
+                    # COMMIT que falha (ocupado, E/S) deixa a transação aberta na conexão compartilhada
+                    self._desfazer(conn)
+                    raise
+            finally:
+                self._profundidade, self._dono = 0, None
+
+    def _desfazer(self, conn):
+        # Ainda sob a trava de escrita: quem montou estado em memória a partir da transação
+        # desfeita (agendas de conflito) o descarta antes da próxima transação começar
+        conn.rollback()
+        for callback in _ao_desfazer: callback()
+
+    # --- Escrita em grupo ---
+    # Escritas curtas de várias sessões ao mesmo tempo (salvar, editar, excluir um atendimento)
+    # entram numa fila limitada atendida por uma thread gravadora, que junta as que chegam na
+    # mesma janela numa transação só: um BEGIN/COMMIT por grupo, em vez de um por sessão.
+    # Cada escrita roda no seu SAVEPOINT; a que falha é desfeita sozinha e o erro volta só
+    # para quem a pediu. O resultado só é entregue depois do COMMIT do grupo.
+    def escrever(self, tarefa):
+        # tarefa(conn): só comandos SQL (sem BEGIN/COMMIT); devolve o resultado dela ou levanta o erro dela
+        if self._dono == threading.get_ident():
+            # Já dentro de uma transação desta thread (inclusive no gravador): participa dela
+            return tarefa(self._escritor)
+        with self._trava:
+            if self._gravador is None or not self._gravador.is_alive():
+                self._gravador = threading.Thread(target=self._gravar, name='banco-gravador', daemon=True)
+                self._gravador.start()
+        pedido = Future()
+        try:
+            self._fila.put((tarefa, pedido), timeout=self.timeout)
+            return pedido.result(timeout=self.timeout)
+        except (queue.Full, FuturesTimeout):
+            # Ainda na fila ou à espera do escritor: cancela e avisa. Já em andamento, o grupo tem a vez
+            # do escritor e só falta rodar (BEGIN IMMEDIATE e COMMIT limitados pelo timeout da conexão)
+            if not pedido.cancel(): return pedido.result()
+            raise TimeoutError('Muitas gravações simultâneas; tente novamente em instantes.') from None
+
+    def _gravar(self):
+        fim = False
+        while not fim:
+            item = self._fila.get()
+            if item is None: return
+            grupo, limite = [item], monotonic() + JANELA_GRUPO_S
+            while len(grupo) < MAX_GRUPO:
+                try: item = self._fila.get(timeout=max(0.0, limite - monotonic()))
+                except queue.Empty: break
+                if item is None:
+                    fim = True
+                    break
+                grupo.append(item)
+            # A vez do escritor (transacao() de outra thread) é esperada com limite e antes de marcar
+            # os pedidos como em andamento: até aqui quem chamou ainda consegue desistir (cancelar)
+            if not self._trava_escrita.acquire(timeout=self.timeout):
+                erro = TimeoutError('Muitas gravações simultâneas; tente novamente em instantes.')
+                for _, pedido in grupo:
+                    if pedido.set_running_or_notify_cancel(): pedido.set_exception(erro)
+                continue
+            try:
+                # Quem desistiu (timeout) enquanto esperava sai do grupo
+                grupo = [(tarefa, pedido) for tarefa, pedido in grupo if pedido.set_running_or_notify_cancel()]
+                if not grupo: continue
+                resultados = []
+                try:
+                    with self.transacao() as conn:
+                        for tarefa, pedido in grupo:
+                            conn.execute('SAVEPOINT escrita')
+                            try:
+                                resultados.append((pedido, tarefa(conn), None))
+                            except Exception as e:
+                                conn.execute('ROLLBACK TO escrita')
+                                resultados.append((pedido, None, _erro_gravacao(e)))
+                            conn.execute('RELEASE escrita')
+                except Exception as e:
+                    # BEGIN ou COMMIT falhou: nada do grupo foi gravado
+                    erro = _erro_gravacao(e)
+                    for _, pedido in grupo: pedido.set_exception(erro)
+                    continue
+            finally:
+                self._trava_escrita.release()
+            for pedido, resultado, erro in resultados:
+                if erro is None: pedido.set_result(resultado)
+                else: pedido.set_exception(erro)
+
+    def _parar_gravador(self):
+        # Termina o que veio antes do sinal de parada; o que entrou depois falha em vez de esperar para sempre
+        # Continua registrado até o join, para que escrever() não suba um segundo gravador que pegue o sinal
+        gravador = self._gravador
+        if gravador is not None:
+            self._fila.put(None)
+            gravador.join()
+            with self._trava:
+                if self._gravador is gravador: self._gravador = None
+        while True:
+            try: item = self._fila.get_nowait()
+            except queue.Empty: break
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError('Banco fechado antes de a gravação ser feita.'))
+
+    def versao_dados(self):
+        # Muda a cada commit de qualquer outra conexão, deste ou de outro processo (api.py,
+        # scripts): como a sentinela nunca escreve, cobre todas as escritas em todas as tabelas
+        with self._trava_sentinela:
+            if self._sentinela is None:
+                self._sentinela = self._conectar()
+            return id(self._sentinela), self._sentinela.execute('PRAGMA data_version').fetchone()[0]
+
+    def migrar(self):
+        if self._migrado:
+            return
+        # Banco já em dia (o caso comum na partida): basta ler a versão, sem pegar o lock de escrita
+        if self.leitura().execute('PRAGMA user_version').fetchone()[0] >= len(MIGRACOES):
+            self._migrado = True
+            return
+        with self._trava_escrita:
+            if self._migrado:
+                return
+            with self.transacao() as conn:
+                versao = conn.execute('PRAGMA user_version').fetchone()[0]
+                for numero, passo in enumerate(MIGRACOES[versao:], start=versao + 1):
+                    passo(conn)
+                    conn.execute(f'PRAGMA user_version={numero}')
+            self._migrado = True
+
+    def definir_rastreio(self, callback):
+        # Aplica o callback de trace (ou None) às conexões já abertas
+        with self._trava_escrita, self._trava:
+            conexoes = [conn for _, conn in self._leitores.values()] + self._livres
+            if self._escritor is not None:
+                conexoes.append(self._escritor)
+            for conn in conexoes:
+                conn.set_trace_callback(callback)
+
+    # --- Arquivos anuais (ver ARQUIVAMENTO POR ANO) ---
+    def caminho_arquivo(self, arquivo):
+        # Os arquivos anuais ficam ao lado do banco principal; o registro guarda só o nome
+        return os.path.join(os.path.dirname(os.path.abspath(self.caminho)), arquivo)
+
+    def anexar(self, conn, arquivos, criar=False):
+        # arquivos: {ano: nome do arquivo}. Anexa à conexão os que faltam (fora de transação)
+        # e devolve os nomes de esquema; desanexa os que sobrarem se o limite for atingido.
+        # ATTACH de um arquivo inexistente criaria um banco vazio: só arquivar_ano pode criar.
+        if not criar:
+            for ano, nome in arquivos.items():
+                if not os.path.exists(self.caminho_arquivo(nome)):
+                    raise FileNotFoundError(f'Arquivo do ano {ano} ausente: {self.caminho_arquivo(nome)}')
+        necessarios = {esquema_arquivo(ano): nome for ano, nome in arquivos.items()}
+        if len(necessarios) > MAX_ANEXOS:
+            raise ValueError(f'A consulta abrange mais de {MAX_ANEXOS} anos arquivados; restrinja o período.')
+        anexados = {row[1] for row in conn.execute('PRAGMA database_list')} - {'main', 'temp'}
+        if len(anexados | set(necessarios)) > MAX_ANEXOS:
+            for esquema in anexados - set(necessarios):
+                conn.execute(f'DETACH DATABASE {esquema}')
+        for esquema, nome in necessarios.items():
+            if esquema not in anexados:
+                conn.execute(f'ATTACH DATABASE ? AS {esquema}', (self.caminho_arquivo(nome),))
+        return list(necessarios)
+
+    @contextmanager
+    def transacao_anexada(self, arquivos, criar=False):
+        # ATTACH não é permitido dentro de transação: anexa ao escritor antes do BEGIN.
+        # Com WAL, o commit é atômico por arquivo (não entre o principal e o anexado).
+        with self._trava_escrita:
+            if self._profundidade:
+                raise RuntimeError('transacao_anexada() não pode rodar dentro de outra transação')
+            if self._escritor is None:
+                self._escritor = self._conectar()
+            esquemas = self.anexar(self._escritor, arquivos, criar)
+            try:
+                with self.transacao() as conn:
+                    yield conn, esquemas
+            finally:
+                for esquema in esquemas:
+                    self._escritor.execute(f'DETACH DATABASE {esquema}')
+
+    def compactar(self):
+        # VACUUM também não roda em transação; só o arquivo principal (quente) é reescrito
+        with self._trava_escrita:
+            if self._escritor is None:
+                self._escritor = self._conectar()
+            self._escritor.execute('VACUUM')
+
+    def fechar(self):
+        # O gravador termina o que já está na fila antes de a conexão de escrita ser fechada
+        self._parar_gravador()
+        with self._trava_escrita, self._trava:
+            for conn in [conn for _, conn in self._leitores.values()] + self._livres:
+                conn.close()
+            self._leitores.clear()
+            self._livres.clear()
+            with self._trava_sentinela:
+                if self._sentinela is not None:
+                    self._sentinela.close()
+                    self._sentinela = None
+            if self._escritor is not None:
+                self._escritor.close()
+                self._escritor = None
+
+
+def _erro_gravacao(e):
+    # Banco ocupado por outro processo (api.py, scripts) além do busy_timeout: para quem pediu
+    # é o mesmo caso da fila cheia, e as telas já tratam TimeoutError
+    if isinstance(e, sqlite3.OperationalError) and 'locked' in str(e):  # "database is locked" (SQLITE_BUSY/LOCKED)
+        erro = TimeoutError('Banco ocupado por outra gravação; tente novamente em instantes.')
+        erro.__cause__ = e
+        return erro
+    return e
+
+
+# --- MIGRAÇÕES ---
+# Cada passo roda uma única vez por banco, na ordem da lista, dentro da mesma transação
+# que grava o novo PRAGMA user_version. Novos passos entram sempre no fim da lista.
+def _migracao_esquema_base(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS usuarios 
+                    (username TEXT PRIMARY KEY, password TEXT, tipo TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS funcoes 
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT, valor_hora REAL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS atendimentos 
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, inicio TEXT, termino TEXT, 
+                     funcao TEXT, valor_total REAL, usuario_responsavel TEXT, detalhes TEXT,
+                     paciente TEXT, periodo TEXT)''')
+
+    # Bancos de versões antigas não tinham estas colunas
+    colunas = {row[1] for row in conn.execute('PRAGMA table_info(atendimentos)')}
+    for col in ('usuario_responsavel', 'detalhes', 'paciente', 'periodo'):
+        if col not in colunas:
+            conn.execute(f'ALTER TABLE atendimentos ADD COLUMN {col} TEXT')
+
+    if conn.execute('SELECT count(*) FROM usuarios').fetchone()[0] == 0:
+        conn.execute('INSERT INTO usuarios VALUES (?, ?, ?)',
+                     ('admin', hashlib.sha256(b'admin123').hexdigest(), 'admin'))
+
+def _migracao_indices_filtros(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_atend_usuario_inicio ON atendimentos (usuario_responsavel, inicio)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_atend_funcao_inicio ON atendimentos (funcao, inicio)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_atend_inicio ON atendimentos (inicio)')
+
+# --- RESUMO MENSAL ---
+# Agregado por (ano, mes, funcao, usuario_responsavel) mantido por triggers, ou seja,
+# na mesma transação de qualquer INSERT/UPDATE/DELETE em atendimentos.
+# As expressões seguem o esquema atual (datas em epoch); a migração que muda o
+# formato das datas recria os triggers e reconstrói o resumo.
+_CHAVE_RESUMO = {
+    'ano': "coalesce(CAST(strftime('%Y', {r}.inicio, 'unixepoch') AS INTEGER), 0)",
+    'mes': "coalesce(CAST(strftime('%m', {r}.inicio, 'unixepoch') AS INTEGER), 0)",
+    'funcao': "coalesce({r}.funcao, '')",
+    'usuario_responsavel': "coalesce({r}.usuario_responsavel, '')",
+}
+_HORAS_RESUMO = "({r}.termino - {r}.inicio) / 3600.0"
+
+def _expr_resumo(r):
+    chave = {col: expr.format(r=r) for col, expr in _CHAVE_RESUMO.items()}
+    return chave, f"coalesce({r}.valor_total, 0)", f"coalesce({_HORAS_RESUMO.format(r=r)}, 0)"
+
+def _sql_somar_resumo(r):
+    chave, valor, horas = _expr_resumo(r)
+    return f'''INSERT INTO resumo_mensal (ano, mes, funcao, usuario_responsavel, valor, horas, qtd)
+                VALUES ({', '.join(chave.values())}, {valor}, {horas}, 1)
+                ON CONFLICT (ano, mes, funcao, usuario_responsavel) DO UPDATE
+                SET valor = valor + excluded.valor, horas = horas + excluded.horas, qtd = qtd + 1;'''
+
+def _sql_subtrair_resumo(r):
+    chave, valor, horas = _expr_resumo(r)
+    where = ' AND '.join(f'{col} = {expr}' for col, expr in chave.items())
+    return f'''UPDATE resumo_mensal SET valor = valor - {valor}, horas = horas - {horas}, qtd = qtd - 1
+                WHERE {where};
+                DELETE FROM resumo_mensal WHERE qtd <= 0 AND {where};'''
+
+def criar_triggers_resumo(conn):
+    for nome in ('trg_resumo_insert', 'trg_resumo_delete', 'trg_resumo_update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {nome}')
+    conn.execute(f'''CREATE TRIGGER trg_resumo_insert AFTER INSERT ON atendimentos
+                    BEGIN {_sql_somar_resumo('NEW')} END''')
+    conn.execute(f'''CREATE TRIGGER trg_resumo_delete AFTER DELETE ON atendimentos
+                    BEGIN {_sql_subtrair_resumo('OLD')} END''')
+    conn.execute(f'''CREATE TRIGGER trg_resumo_update
+                    AFTER UPDATE OF inicio, termino, funcao, valor_total, usuario_responsavel ON atendimentos
+                    BEGIN {_sql_subtrair_resumo('OLD')} {_sql_somar_resumo('NEW')} END''')
+
+def _somar_resumo(conn, esquemas, tabela='resumo_mensal'):
+    chave, valor, horas = _expr_resumo('a')
+    for esquema in esquemas:
+        conn.execute(f'''INSERT INTO {tabela} (ano, mes, funcao, usuario_responsavel, valor, horas, qtd)
+                        SELECT {', '.join(chave.values())}, sum({valor}), sum({horas}), count(*)
+                        FROM {esquema}.atendimentos a GROUP BY 1, 2, 3, 4
+                        ON CONFLICT (ano, mes, funcao, usuario_responsavel) DO UPDATE
+                        SET valor = valor + excluded.valor, horas = horas + excluded.horas, qtd = qtd + excluded.qtd''')
+
+def reconstruir_resumo_mensal(conn, esquemas=()):
+    # esquemas: anos arquivados já anexados à conexão, somados ao banco principal
+    conn.execute('DELETE FROM resumo_mensal')
+    _somar_resumo(conn, ['main'] + list(esquemas))
+
+def _migracao_resumo_mensal(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS resumo_mensal
+                    (ano INTEGER, mes INTEGER, funcao TEXT, usuario_responsavel TEXT,
+                     valor REAL NOT NULL DEFAULT 0, horas REAL NOT NULL DEFAULT 0, qtd INTEGER NOT NULL DEFAULT 0,
+                     PRIMARY KEY (ano, mes, funcao, usuario_responsavel)) WITHOUT ROWID''')
+    criar_triggers_resumo(conn)
+    reconstruir_resumo_mensal(conn)
+
+def _migracao_datas_epoch(conn):
+    # Afinidade TEXT converteria o inteiro de volta para texto: recria a tabela com INTEGER
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'atendimentos'").fetchone()
+    conn.execute('''CREATE TABLE atendimentos_novo
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, inicio INTEGER, termino INTEGER,
+                     funcao TEXT, valor_total REAL, usuario_responsavel TEXT, detalhes TEXT,
+                     paciente TEXT, periodo TEXT)''')
+    conn.execute('''INSERT INTO atendimentos_novo
+                    (id, inicio, termino, funcao, valor_total, usuario_responsavel, detalhes, paciente, periodo)
+                    SELECT id, CAST(strftime('%s', inicio) AS INTEGER), CAST(strftime('%s', termino) AS INTEGER),
+                           funcao, valor_total, usuario_responsavel, detalhes, paciente, periodo
+                    FROM atendimentos''')
+    conn.execute('DROP TABLE atendimentos')
+    conn.execute('ALTER TABLE atendimentos_novo RENAME TO atendimentos')
+    if seq is not None:
+        # Mantém o AUTOINCREMENT sem reaproveitar IDs de registros já excluídos
+        conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'atendimentos'", seq)
+    _migracao_indices_filtros(conn)
+    criar_triggers_resumo(conn)
+    reconstruir_resumo_mensal(conn)
+
+# --- INSERÇÃO EM MASSA ---
+COLUNAS_ATENDIMENTO = ('inicio', 'termino', 'funcao', 'valor_total', 'usuario_responsavel', 'detalhes', 'paciente', 'periodo',
+                       'funcao_id')
+LIMIAR_MASSA = 1000
+
+def inserir_atendimentos(conn, linhas, limiar=LIMIAR_MASSA):
+    # Deve rodar dentro de transacao(). Acima do limiar, os triggers de inserção são
+    # suspensos (DDL também é transacional) e resumo/busca são atualizados de uma vez
+    # para as linhas novas: ~4x mais rápido que disparar os triggers linha a linha.
+    sql = (f"INSERT INTO atendimentos ({', '.join(COLUNAS_ATENDIMENTO)}) "
+           f"VALUES ({', '.join('?' * len(COLUNAS_ATENDIMENTO))})")
+    if len(linhas) < limiar:
+        conn.executemany(sql, linhas)
+        return
+    ultimo_id = conn.execute('SELECT coalesce(max(id), 0) FROM atendimentos').fetchone()[0]
+    conn.execute('DROP TRIGGER IF EXISTS trg_resumo_insert')
+    conn.execute('DROP TRIGGER IF EXISTS trg_fts_insert')
+    conn.execute('DROP TRIGGER IF EXISTS trg_mudanca_insert')
+    conn.executemany(sql, linhas)
+    chave, valor, horas = _expr_resumo('a')
+    conn.execute(f'''INSERT INTO resumo_mensal (ano, mes, funcao, usuario_responsavel, valor, horas, qtd)
+                     SELECT {', '.join(chave.values())}, sum({valor}), sum({horas}), count(*)
+                     FROM atendimentos a WHERE a.id > ? GROUP BY 1, 2, 3, 4
+                     ON CONFLICT (ano, mes, funcao, usuario_responsavel) DO UPDATE
+                     SET valor = valor + excluded.valor, horas = horas + excluded.horas, qtd = qtd + excluded.qtd''',
+                 (ultimo_id,))
+    conn.execute('''INSERT INTO atendimentos_fts (rowid, paciente, detalhes)
+                    SELECT id, paciente, detalhes FROM atendimentos WHERE id > ?''', (ultimo_id,))
+    conn.execute('INSERT INTO mudancas (id) SELECT id FROM atendimentos WHERE id > ?', (ultimo_id,))
+    criar_triggers_resumo(conn)
+    criar_triggers_busca(conn)
+    criar_triggers_mudancas(conn)
+
+
+# --- ATUALIZAÇÃO EM MASSA ---
+def _ajustar_resumo(conn, sinal):
+    # Soma (sinal=1) ou subtrai (sinal=-1) do resumo as linhas marcadas em temp.ids_massa
+    chave, valor, horas = _expr_resumo('a')
+    conn.execute(f'''INSERT INTO resumo_mensal (ano, mes, funcao, usuario_responsavel, valor, horas, qtd)
+                     SELECT {', '.join(chave.values())}, {sinal} * sum({valor}), {sinal} * sum({horas}), {sinal} * count(*)
+                     FROM atendimentos a WHERE a.id IN (SELECT id FROM temp.ids_massa) GROUP BY 1, 2, 3, 4
+                     ON CONFLICT (ano, mes, funcao, usuario_responsavel) DO UPDATE
+                     SET valor = valor + excluded.valor, horas = horas + excluded.horas, qtd = qtd + excluded.qtd''')
+    conn.execute('DELETE FROM resumo_mensal WHERE qtd <= 0')
+
+def atualizar_em_massa(conn, atribuicoes, where, params=(), juncao=None, valores=()):
+    # Deve rodar dentro de transacao(). Um único UPDATE (com FROM opcional: o "UPDATE ... JOIN"
+    # do SQLite) em vez de um por linha; o trigger de resumo é suspenso e o resumo_mensal é
+    # ajustado por grupo antes e depois. valores: parâmetros de `atribuicoes`; params: de `where`.
+    # Devolve a quantidade de linhas alteradas.
+    de = f' FROM {juncao}' if juncao else ''
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS ids_massa (id INTEGER PRIMARY KEY)')
+    conn.execute('DELETE FROM temp.ids_massa')
+    conn.execute(f'INSERT INTO temp.ids_massa SELECT atendimentos.id FROM atendimentos{", " + juncao if juncao else ""} WHERE {where}',
+                 params)
+    _ajustar_resumo(conn, -1)
+    conn.execute('DROP TRIGGER IF EXISTS trg_resumo_update')
+    conn.execute('DROP TRIGGER IF EXISTS trg_mudanca_update')
+    alteradas = conn.execute(f'UPDATE atendimentos SET {atribuicoes}{de} '
+                             f'WHERE atendimentos.id IN (SELECT id FROM temp.ids_massa) AND {where}',
+                             tuple(valores) + tuple(params)).rowcount
+    _ajustar_resumo(conn, 1)
+    conn.execute('INSERT INTO mudancas (id) SELECT id FROM temp.ids_massa')
+    criar_triggers_resumo(conn)
+    criar_triggers_mudancas(conn)
+    conn.execute('DROP TABLE temp.ids_massa')
+    return alteradas
+
+
+# --- BUSCA TEXTUAL ---
+# Índice FTS5 de conteúdo externo sobre paciente/detalhes, sincronizado por triggers.
+# remove_diacritics: "jose" encontra "José"; prefix: acelera buscas por "mar"*.
+def criar_triggers_busca(conn):
+    for nome in ('trg_fts_insert', 'trg_fts_delete', 'trg_fts_update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {nome}')
+    inserir = 'INSERT INTO atendimentos_fts (rowid, paciente, detalhes) VALUES (NEW.id, NEW.paciente, NEW.detalhes);'
+    remover = ("INSERT INTO atendimentos_fts (atendimentos_fts, rowid, paciente, detalhes) "
+               "VALUES ('delete', OLD.id, OLD.paciente, OLD.detalhes);")
+    conn.execute(f'CREATE TRIGGER trg_fts_insert AFTER INSERT ON atendimentos BEGIN {inserir} END')
+    conn.execute(f'CREATE TRIGGER trg_fts_delete AFTER DELETE ON atendimentos BEGIN {remover} END')
+    conn.execute(f'''CREATE TRIGGER trg_fts_update AFTER UPDATE OF paciente, detalhes ON atendimentos
+                     BEGIN {remover} {inserir} END''')
+
+def _migracao_busca_texto(conn):
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS atendimentos_fts USING fts5
+                    (paciente, detalhes, content='atendimentos', content_rowid='id',
+                     tokenize='unicode61 remove_diacritics 2', prefix='2 3')''')
+    criar_triggers_busca(conn)
+    conn.execute("INSERT INTO atendimentos_fts (atendimentos_fts) VALUES ('rebuild')")
+
+# --- ARQUIVAMENTO POR ANO ---
+# Anos fechados saem do banco principal para atendimentos_<ano>.db (mesmo esquema, com
+# índices e busca textual próprios), registrados na tabela arquivos. As consultas anexam
+# só os arquivos dos anos que o intervalo alcança. O resumo_mensal dos anos arquivados
+# fica no banco principal, então KPIs e tendência não precisam anexar nada.
+MAX_ANEXOS = 9  # SQLITE_MAX_ATTACHED padrão é 10
+COLUNAS_CONSULTA = ('id',) + COLUNAS_ATENDIMENTO
+
+def esquema_arquivo(ano):
+    return f'arq_{int(ano)}'
+
+def _migracao_arquivos(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS arquivos
+                    (ano INTEGER PRIMARY KEY, arquivo TEXT NOT NULL, qtd INTEGER NOT NULL DEFAULT 0, arquivado_em INTEGER)''')
+
+def _criar_esquema_arquivo(conn, esquema):
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {esquema}.atendimentos
+                     (id INTEGER PRIMARY KEY, inicio INTEGER, termino INTEGER, funcao TEXT, valor_total REAL,
+                      usuario_responsavel TEXT, detalhes TEXT, paciente TEXT, periodo TEXT, funcao_id INTEGER)''')
+    _indice_conflitos_arquivo(conn, esquema)
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {esquema}.idx_atend_funcao_inicio ON atendimentos (funcao, inicio)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {esquema}.idx_atend_inicio ON atendimentos (inicio)')
+    conn.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {esquema}.atendimentos_fts USING fts5
+                     (paciente, detalhes, content='atendimentos', content_rowid='id',
+                      tokenize='unicode61 remove_diacritics 2', prefix='2 3')''')
+
+def arquivos_registrados(conn):
+    # {ano: arquivo} de todos os anos arquivados
+    return dict(conn.execute('SELECT ano, arquivo FROM arquivos ORDER BY ano').fetchall())
+
+def blocos_arquivos(arquivos):
+    # Uma conexão anexa no máximo MAX_ANEXOS arquivos: divide os anos arquivados em blocos de
+    # anos consecutivos, cada um com a faixa [desde, ate) de inicio (epoch; None = sem limite)
+    # que cobre. O banco principal consultado em cada bloco só na faixa dele: as partes saem
+    # disjuntas e, na ordem dos blocos, já ordenadas por inicio. Até MAX_ANEXOS anos, um bloco só.
+    anos = sorted(arquivos)
+    grupos = [anos[i:i + MAX_ANEXOS] for i in range(0, len(anos), MAX_ANEXOS)] or [[]]
+    limites = [None] + [para_epoch(datetime(grupo[0], 1, 1)) for grupo in grupos[1:]] + [None]
+    return [(limites[i], limites[i + 1], {ano: arquivos[ano] for ano in grupo}) for i, grupo in enumerate(grupos)]
+
+def origem_atendimentos(esquemas):
+    # FROM para consultas de leitura: a tabela principal, ou ela unida aos anos anexados
+    # (o SQLite empurra o WHERE externo para dentro de cada parte do UNION ALL)
+    if not esquemas:
+        return 'atendimentos'
+    colunas = ', '.join(COLUNAS_CONSULTA)
+    partes = [f'SELECT {colunas} FROM {e}.atendimentos' for e in ['main'] + list(esquemas)]
+    return f"({' UNION ALL '.join(partes)}) AS atendimentos"
+
+def arquivar_ano(ano):
+    # Move os atendimentos do ano para o arquivo anual (acrescenta se ele já existir).
+    # O resumo_mensal não muda: os triggers de exclusão ficam suspensos durante a remoção
+    # (e o log de mudanças também: para o instantâneo analítico a linha continua existindo).
+    banco = obter_banco()
+    arquivo = f'{os.path.splitext(os.path.basename(banco.caminho))[0]}_{int(ano)}.db'
+    inicio, fim = para_epoch(datetime(ano, 1, 1)), para_epoch(datetime(ano + 1, 1, 1))
+    colunas = ', '.join(COLUNAS_CONSULTA)
+    with banco.transacao_anexada({ano: arquivo}, criar=True) as (conn, (esquema,)):
+        _criar_esquema_arquivo(conn, esquema)
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS ids_arquivo (id INTEGER PRIMARY KEY)')
+        conn.execute('DELETE FROM temp.ids_arquivo')
+        conn.execute('INSERT INTO temp.ids_arquivo SELECT id FROM main.atendimentos WHERE inicio >= ? AND inicio < ?',
+                     (inicio, fim))
+        # OR REPLACE: repetir o arquivamento após uma falha entre os dois arquivos é seguro
+        movidos = conn.execute(f'''INSERT OR REPLACE INTO {esquema}.atendimentos ({colunas})
+                                   SELECT {colunas} FROM main.atendimentos WHERE id IN (SELECT id FROM temp.ids_arquivo)''').rowcount
+        conn.execute(f"INSERT INTO {esquema}.atendimentos_fts (atendimentos_fts) VALUES ('rebuild')")
+        conn.execute('DROP TRIGGER IF EXISTS trg_resumo_delete')
+        conn.execute('DROP TRIGGER IF EXISTS trg_fts_delete')
+        conn.execute('DROP TRIGGER IF EXISTS trg_mudanca_delete')
+        conn.execute('''INSERT INTO main.atendimentos_fts (atendimentos_fts, rowid, paciente, detalhes)
+                        SELECT 'delete', id, paciente, detalhes FROM main.atendimentos
+                        WHERE id IN (SELECT id FROM temp.ids_arquivo)''')
+        conn.execute('DELETE FROM main.atendimentos WHERE id IN (SELECT id FROM temp.ids_arquivo)')
+        criar_triggers_resumo(conn)
+        criar_triggers_busca(conn)
+        criar_triggers_mudancas(conn)
+        conn.execute('DROP TABLE temp.ids_arquivo')
+        qtd = conn.execute(f'SELECT count(*) FROM {esquema}.atendimentos').fetchone()[0]
+        conn.execute('''INSERT INTO arquivos (ano, arquivo, qtd, arquivado_em) VALUES (?, ?, ?, strftime('%s', 'now'))
+                        ON CONFLICT (ano) DO UPDATE SET arquivo = excluded.arquivo, qtd = excluded.qtd,
+                        arquivado_em = excluded.arquivado_em''', (ano, arquivo, qtd))
+    return movidos
+
+def reconstruir_resumo_completo():
+    # Reconstrói o resumo_mensal a partir do banco principal e de todos os anos arquivados
+    banco = obter_banco()
+    blocos = blocos_arquivos(arquivos_registrados(banco.leitura()))
+    if len(blocos) == 1:
+        with banco.transacao_anexada(blocos[0][2]) as (conn, esquemas):
+            reconstruir_resumo_mensal(conn, esquemas)
+        return
+    # Mais anos do que cabem anexados de uma vez: cada bloco soma numa tabela temporária
+    # e o resumo_mensal é trocado numa transação só, no fim
+    with banco.transacao() as conn:
+        conn.execute('DROP TABLE IF EXISTS temp.resumo_arquivados')
+        conn.execute('CREATE TEMP TABLE resumo_arquivados AS SELECT * FROM main.resumo_mensal WHERE 0')
+        conn.execute('CREATE UNIQUE INDEX temp.idx_resumo_arquivados ON resumo_arquivados (ano, mes, funcao, usuario_responsavel)')
+    for _, _, bloco in blocos:
+        with banco.transacao_anexada(bloco) as (conn, esquemas):
+            _somar_resumo(conn, esquemas, 'temp.resumo_arquivados')
+    with banco.transacao() as conn:
+        reconstruir_resumo_mensal(conn)
+        conn.execute('''INSERT INTO resumo_mensal SELECT * FROM temp.resumo_arquivados WHERE true
+                        ON CONFLICT (ano, mes, funcao, usuario_responsavel) DO UPDATE
+                        SET valor = valor + excluded.valor, horas = horas + excluded.horas, qtd = qtd + excluded.qtd''')
+        conn.execute('DROP TABLE temp.resumo_arquivados')
+
+
+# --- REFERÊNCIA À FUNÇÃO ---
+# atendimentos.funcao continua guardando o nome (exibido nos relatórios e chave do resumo);
+# funcao_id é a referência usada para renomear e reprecificar. Nomes sem função cadastrada
+# ficam com funcao_id NULL, e excluir uma função não apaga o histórico (SET NULL).
+def _migracao_funcao_id(conn):
+    conn.execute('ALTER TABLE atendimentos ADD COLUMN funcao_id INTEGER REFERENCES funcoes (id) ON DELETE SET NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_funcoes_nome ON funcoes (nome)')
+    conn.execute('''UPDATE atendimentos SET funcao_id = f.id
+                    FROM (SELECT nome, min(id) AS id FROM funcoes GROUP BY nome) f
+                    WHERE f.nome = atendimentos.funcao''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_atend_funcao_id_inicio ON atendimentos (funcao_id, inicio)')
+
+# --- LOG DE MUDANÇAS ---
+# Cada INSERT/UPDATE/DELETE em atendimentos acrescenta o id da linha em mudancas, em
+# ordem de seq (AUTOINCREMENT: nunca reaproveitado, mesmo depois da limpeza). Quem
+# consome o log (o instantâneo do analitico.py) relê só os ids com seq acima da sua
+# marca e depois descarta o que já foi aplicado com limpar_mudancas().
+# Sem ninguém atualizando o instantâneo, o log guarda só as últimas MAX_MUDANCAS entradas:
+# quem ficou para trás percebe a lacuna (menor seq acima da sua marca) e relê tudo.
+MAX_MUDANCAS = 100_000
+
+def criar_triggers_mudancas(conn):
+    for evento, linha in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_mudanca_{evento}')
+        # Dentro do trigger, last_insert_rowid() é o seq recém-gravado: poda por faixa da chave
+        conn.execute(f'''CREATE TRIGGER trg_mudanca_{evento} AFTER {evento.upper()} ON atendimentos
+                         BEGIN INSERT INTO mudancas (id) VALUES ({linha}.id);
+                               DELETE FROM mudancas WHERE seq <= last_insert_rowid() - {MAX_MUDANCAS}; END''')
+    # As operações em massa gravam o log sem os triggers e os recriam aqui ao terminar
+    conn.execute('DELETE FROM mudancas WHERE seq <= (SELECT max(seq) FROM mudancas) - ?', (MAX_MUDANCAS,))
+
+def _migracao_mudancas(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS mudancas (seq INTEGER PRIMARY KEY AUTOINCREMENT, id INTEGER NOT NULL)')
+    criar_triggers_mudancas(conn)
+
+def limpar_mudancas(ate_seq):
+    with transacao() as conn:
+        conn.execute('DELETE FROM mudancas WHERE seq <= ?', (ate_seq,))
+
+def _migracao_limite_mudancas(conn):
+    criar_triggers_mudancas(conn)  # triggers com a poda por MAX_MUDANCAS
+
+# --- CONFLITOS DE HORÁRIO ---
+# termino no índice: a checagem de sobreposição e a varredura da auditoria (servico.py)
+# leem só o índice. Ele substitui o (usuario_responsavel, inicio), que é seu prefixo.
+def _migracao_indice_conflitos(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_atend_usuario_inicio_termino ON atendimentos (usuario_responsavel, inicio, termino)')
+    conn.execute('DROP INDEX IF EXISTS idx_atend_usuario_inicio')
+
+def _indice_conflitos_arquivo(conn, esquema):
+    # Mesmo índice do banco principal nos arquivos anuais
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {esquema}.idx_atend_usuario_inicio_termino ON atendimentos (usuario_responsavel, inicio, termino)')
+    conn.execute(f'DROP INDEX IF EXISTS {esquema}.idx_atend_usuario_inicio')
+
+def _migracao_indice_conflitos_arquivos(conn):
+    # Arquivos anuais criados antes ainda têm o índice antigo. ATTACH não roda dentro da
+    # transação da migração: cada arquivo é ajustado pela própria conexão (idempotente)
+    pasta = os.path.dirname(conn.execute('PRAGMA database_list').fetchone()[2])
+    for arquivo in arquivos_registrados(conn).values():
+        caminho = os.path.join(pasta, arquivo)
+        if not os.path.exists(caminho): continue
+        arq = sqlite3.connect(caminho, timeout=TIMEOUT_OCUPADO)
+        try:
+            with arq: _indice_conflitos_arquivo(arq, 'main')
+        finally:
+            arq.close()
+
+MIGRACOES = [
+    _migracao_esquema_base,
+    _migracao_indices_filtros,
+    _migracao_resumo_mensal,
+    _migracao_datas_epoch,
+    _migracao_busca_texto,
+    _migracao_funcao_id,
+    _migracao_arquivos,
+    _migracao_mudancas,
+    _migracao_indice_conflitos,
+    _migracao_indice_conflitos_arquivos,
+    _migracao_limite_mudancas,
+]
+
+
+# --- INSTÂNCIA DO PROCESSO ---
+_banco = None
+_trava_banco = threading.Lock()
+_rastreio = None  # callback de trace do sqlite3 instalado em toda conexão nova (desempenho.py)
+_ao_desfazer = []  # callbacks chamados quando uma transação é desfeita (servico.py)
+
+def obter_banco():
+    global _banco
+    with _trava_banco:
+        if _banco is None:
+            _banco = Banco()
+        return _banco
+
+def configurar(caminho=CAMINHO_PADRAO, timeout=TIMEOUT_OCUPADO):
+    global _banco
+    with _trava_banco:
+        if _banco is not None:
+            _banco.fechar()
+        _banco = Banco(caminho, timeout)
+        return _banco
+
+def inicializar():
+    banco = obter_banco()
+    banco.migrar()
+    return banco
+
+def anexar(conn, arquivos, criar=False):
+    return obter_banco().anexar(conn, arquivos, criar)
+
+def compactar():
+    obter_banco().compactar()
+
+def definir_rastreio(callback):
+    global _rastreio
+    _rastreio = callback
+    obter_banco().definir_rastreio(callback)
+
+def ao_desfazer(callback):
+    _ao_desfazer.append(callback)
+
+def leitura():
+    return obter_banco().leitura()
+
+def versao_dados():
+    return obter_banco().versao_dados()
+
+def transacao():
+    return obter_banco().transacao()
+
+def escrever(tarefa):
+    return obter_banco().escrever(tarefa)
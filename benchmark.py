@@ -0,0 +1,252 @@
+# Benchmark headless dos caminhos de dados, relatório e exportação do app.py.
+# Gera um atendimentos.db descartável com dados sintéticos e mede as funções que
+# o app usa em cada tela, sem precisar de `streamlit run`:
+#
+#     python benchmark.py --linhas 100000 --usuarios 50 --funcoes 20 --saida atual.json
+#     python benchmark.py --linhas 100000 --comparar atual.json
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import banco
+import cache
+import servico
+from relatorios import criar_excel_relatorio, criar_pdf_relatorio
+
+NOMES = ['Maria', 'José', 'Ana', 'João', 'Antônio', 'Francisca', 'Carlos', 'Luíza', 'Paulo', 'Conceição',
+         'Pedro', 'Adriana', 'Lucas', 'Juliana', 'Marcos', 'Sebastião', 'Márcia', 'Raimundo', 'Fernanda', 'Cícero']
+SOBRENOMES = ['da Silva', 'dos Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira',
+              'Lima', 'Gomes', 'Ribeiro', 'Carvalho', 'Araújo', 'Magalhães', 'Conceição', 'Gonçalves']
+FRASES = ['Aferição de pressão arterial e glicemia capilar.', 'Curativo em lesão por pressão na região sacral.',
+          'Administração de medicação conforme prescrição médica.', 'Acompanhamento noturno, paciente estável.',
+          'Banho no leito e mudança de decúbito a cada duas horas.', 'Troca de sonda vesical de demora.',
+          'Paciente agitado, familiares orientados.', 'Aspiração de vias aéreas e nebulização.',
+          'Auxílio na alimentação por sonda nasoenteral.', 'Sinais vitais sem alterações.']
+
+
+# --- DADOS SINTÉTICOS ---
+def gerar_dados(linhas, usuarios, funcoes, anos, semente):
+    rng = np.random.default_rng(semente)
+    with banco.transacao() as conn:
+        conn.executemany('INSERT OR IGNORE INTO usuarios VALUES (?, ?, ?)',
+                         [(f'prof{i:04d}', hashlib.sha256(f'senha{i}'.encode()).hexdigest(), 'comum')
+                          for i in range(usuarios)])
+        conn.executemany('INSERT INTO funcoes (nome, valor_hora) VALUES (?, ?)',
+                         [(f'Função {i:03d}', round(float(v), 2)) for i, v in enumerate(rng.uniform(20, 150, funcoes))])
+    funcs = pd.read_sql('SELECT id, nome, valor_hora FROM funcoes', banco.leitura()).set_index('nome')
+    precos = funcs['valor_hora']
+    nomes_funcoes = precos.index.to_numpy()
+    pesos = 1 / np.arange(1, len(nomes_funcoes) + 1)  # poucas funções concentram a maior parte
+    pesos /= pesos.sum()
+    periodos = np.array([servico.calcular_periodo(datetime(2000, 1, 1, h)) for h in range(24)], dtype=object)
+
+    fim = int(banco.para_epoch(datetime(datetime.now().year + 1, 1, 1)))
+    ini = int(banco.para_epoch(datetime(datetime.now().year - anos + 1, 1, 1)))
+    lote = 50000
+    for inicio_lote in range(0, linhas, lote):
+        n = min(lote, linhas - inicio_lote)
+        inicio = rng.integers(ini, fim, n) // 60 * 60
+        termino = inicio + rng.integers(30, 12 * 60, n) * 60
+        funcao = rng.choice(nomes_funcoes, n, p=pesos)
+        valor = (termino - inicio) / 3600 * precos.reindex(funcao).to_numpy()
+        usuario = np.char.add('prof', np.char.zfill(rng.integers(0, usuarios, n).astype(str), 4))
+        paciente = np.char.add(np.char.add(rng.choice(NOMES, n), ' '), rng.choice(SOBRENOMES, n))
+        detalhes = np.char.add(np.char.add(rng.choice(FRASES, n), ' '), rng.choice(FRASES, n))
+        periodo = periodos[(inicio // 3600) % 24]
+        colunas = [inicio.tolist(), termino.tolist(), funcao.tolist(), valor.round(2).tolist(), usuario.tolist(),
+                   detalhes.tolist(), paciente.tolist(), periodo.tolist(), funcs['id'].reindex(funcao).tolist()]
+        with banco.transacao() as conn:
+            banco.inserir_atendimentos(conn, list(zip(*colunas)))
+
+
+# --- MEDIÇÃO ---
+def _tamanho(resultado):
+    if isinstance(resultado, tuple): resultado = resultado[0]
+    if isinstance(resultado, dict): return resultado.get('qtd')
+    return len(resultado) if hasattr(resultado, '__len__') else None
+
+def medir(nome, func, repeticoes, frio=True, tamanho=None):
+    # frio: limpa os caches antes de cada repetição (mede o custo real, não o acerto de cache)
+    # tamanho: itens processados, quando não for o tamanho do próprio resultado (ex.: linhas do PDF)
+    tempos = []
+    for _ in range(repeticoes):
+        if frio: cache.invalidar()
+        t = time.perf_counter()
+        resultado = func()
+        tempos.append(time.perf_counter() - t)
+    if tamanho is None: tamanho = _tamanho(resultado)
+    caso = {'caso': nome, 'repeticoes': repeticoes, 'min_s': min(tempos), 'mediana_s': statistics.median(tempos),
+            'max_s': max(tempos), 'tamanho': tamanho}
+    if tamanho and caso['mediana_s'] > 0: caso['itens_por_s'] = tamanho / caso['mediana_s']
+    print(f"{nome:<40} {caso['mediana_s'] * 1000:>10.1f} ms  (min {caso['min_s'] * 1000:.1f}, "
+          f"max {caso['max_s'] * 1000:.1f}, tamanho {tamanho})", file=sys.stderr)
+    return caso
+
+def executar(args):
+    casos = []
+    r = args.repeticoes
+    ultimo = banco.leitura().execute('SELECT max(inicio) FROM atendimentos').fetchone()[0]
+    ref = pd.to_datetime(ultimo, unit='s')
+    ano, mes = ref.year, ref.month
+    inicio, fim = servico.intervalo_mes(ano, mes)
+    funcao_top = banco.leitura().execute(
+        'SELECT funcao FROM resumo_mensal GROUP BY funcao ORDER BY sum(qtd) DESC LIMIT 1').fetchone()[0]
+
+    admin, comum = servico.Acesso('admin', 'admin'), servico.Acesso('prof0001', 'comum')
+    casos.append(medir('login_user', lambda: servico.autenticar('prof0001', 'senha1'), r * 10))
+    casos.append(medir('carregar_atendimentos (admin, tudo)', lambda: servico.carregar_atendimentos(admin), r))
+    casos.append(medir('carregar_atendimentos (admin, mês)', lambda: servico.carregar_atendimentos(admin, inicio, fim), r))
+    casos.append(medir('carregar_atendimentos (mês, cache quente)', lambda: servico.carregar_atendimentos(admin, inicio, fim), r * 10, frio=False))
+    casos.append(medir('listar_anos', lambda: servico.listar_anos(admin), r))
+    casos.append(medir('relatorios: filtro mês+função', lambda: servico.carregar_atendimentos(admin, inicio, fim, funcao=funcao_top), r))
+    casos.append(medir('relatorios: KPIs do mês', lambda: servico.carregar_metricas(admin, ano, mes), r))
+    casos.append(medir('relatorios: KPIs via pandas (referência)', lambda: _kpis_pandas(servico.carregar_atendimentos(admin, inicio, fim)), r))
+    casos.append(medir('buscar_atendimentos (prefixo)', lambda: servico.buscar_atendimentos(admin, 'mar sil'), r))
+
+    casos.append(medir('carregar_atendimentos (comum, tudo)', lambda: servico.carregar_atendimentos(comum), r))
+    casos.append(medir('carregar_atendimentos (comum, mês)', lambda: servico.carregar_atendimentos(comum, inicio, fim), r))
+
+    df_mes = servico.carregar_atendimentos(admin, inicio, fim)
+    df_pdf = servico.carregar_atendimentos(admin).tail(args.linhas_pdf)
+    metricas = servico.carregar_metricas(admin, ano, mes)
+    for rotulo, df in [('mês', df_mes), (f'{len(df_pdf)} linhas', df_pdf)]:
+        casos.append(medir(f'criar_pdf_relatorio ({rotulo})', lambda: criar_pdf_relatorio(
+            df, 'Mes', ano, metricas, 'admin', 'Todas'), r, tamanho=len(df)))
+        casos.append(medir(f'criar_excel_relatorio ({rotulo})', lambda: criar_excel_relatorio(df), r, tamanho=len(df)))
+
+    # Por último, porque grava: rajada de sessões salvando ao mesmo tempo (troca de turno)
+    casos.append(medir(f'rajada: salvar_atendimento ({args.sessoes} sessões)', _rajada(ano + 1, funcao_top, args.sessoes),
+                       r, tamanho=args.sessoes * POR_SESSAO))
+    return casos
+
+POR_SESSAO = 5
+
+def _rajada(ano, funcao, sessoes):
+    # Cada sessão (thread) salva POR_SESSAO atendimentos seguidos do seu profissional, todas
+    # ao mesmo tempo; os horários avançam a cada rodada para não haver conflito entre elas
+    rodadas = iter(range(10 ** 6))
+    def sessao(n, inicio, erros):
+        acesso = servico.Acesso(f'rajada{n:03d}', 'comum')
+        for i in range(POR_SESSAO):
+            ini = inicio + timedelta(hours=i)
+            try: servico.salvar_atendimento(acesso, ini, ini + timedelta(minutes=50), funcao, f'Paciente {n}')
+            except Exception as e: erros.append(e)
+    def executar():
+        inicio, erros = datetime(ano, 1, 1, 8) + timedelta(days=next(rodadas)), []
+        threads = [threading.Thread(target=sessao, args=(n, inicio, erros)) for n in range(sessoes)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        if erros: raise RuntimeError(f'{len(erros)} gravações falharam na rajada: {erros[0]!r}')
+    return executar
+
+# --- PARTIDA A FRIO ---
+# Tempo da primeira execução do app.py (tela de login) num processo novo, como na primeira
+# sessão depois de reiniciar o servidor, via AppTest do Streamlit. Confere também que as
+# bibliotecas pesadas ficaram fora da tela de login (só são importadas depois do login).
+META_PRIMEIRA_TELA_MS = 300
+PESADOS = ('pandas', 'pyarrow', 'fpdf', 'xlsxwriter')
+_SCRIPT_PARTIDA = '''
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+t = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+print(json.dumps({'s': time.perf_counter() - t, 'erro': len(at.exception) > 0,
+                  'pesados': [m for m in sys.argv[2:] if m in sys.modules]}))
+'''
+
+def medir_partida(repeticoes):
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, '-c', _SCRIPT_PARTIDA, app, *PESADOS], cwd=os.path.dirname(app),
+                               capture_output=True, text=True, check=True)
+        r = json.loads(saida.stdout.strip().splitlines()[-1])
+        if r['erro']: raise RuntimeError('app.py falhou ao renderizar a tela de login')
+        tempos.append(r['s'])
+    caso = {'caso': 'partida a frio (tela de login)', 'repeticoes': repeticoes, 'min_s': min(tempos),
+            'mediana_s': statistics.median(tempos), 'max_s': max(tempos), 'tamanho': None,
+            'meta_s': META_PRIMEIRA_TELA_MS / 1000, 'pesados_no_login': r['pesados']}
+    situacao = 'dentro da meta' if caso['mediana_s'] * 1000 <= META_PRIMEIRA_TELA_MS else 'ACIMA DA META'
+    print(f"{caso['caso']:<40} {caso['mediana_s'] * 1000:>10.1f} ms  (meta {META_PRIMEIRA_TELA_MS} ms: {situacao}; "
+          f"carregados no login: {', '.join(r['pesados']) or 'nenhum pesado'})", file=sys.stderr)
+    return caso
+
+def _kpis_pandas(df):
+    return {'valor': df['valor_total'].sum(), 'horas': (df['termino'] - df['inicio']).dt.total_seconds().sum() / 3600,
+            'qtd': len(df)}
+
+
+# --- COMPARAÇÃO ---
+def comparar(atual, anterior):
+    base = {c['caso']: c for c in anterior['casos']}
+    print(f"\n{'caso':<40} {'antes':>10} {'agora':>10} {'variação':>9}", file=sys.stderr)
+    for c in atual['casos']:
+        if c['caso'] not in base: continue
+        antes, agora = base[c['caso']]['mediana_s'], c['mediana_s']
+        print(f"{c['caso']:<40} {antes * 1000:>8.1f}ms {agora * 1000:>8.1f}ms {(agora / antes - 1) * 100:>+8.1f}%",
+              file=sys.stderr)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Benchmark headless com dados sintéticos')
+    p.add_argument('--linhas', type=int, default=100000, help='atendimentos sintéticos (10k a 1M)')
+    p.add_argument('--usuarios', type=int, default=50)
+    p.add_argument('--funcoes', type=int, default=20)
+    p.add_argument('--anos', type=int, default=3, help='anos de histórico até o ano atual')
+    p.add_argument('--semente', type=int, default=42)
+    p.add_argument('--repeticoes', type=int, default=3)
+    p.add_argument('--linhas-pdf', type=int, default=10000, help='linhas do caso de PDF/Excel grande')
+    p.add_argument('--sessoes', type=int, default=32, help='sessões gravando ao mesmo tempo no caso de rajada')
+    p.add_argument('--banco', help='arquivo do banco descartável (padrão: diretório temporário)')
+    p.add_argument('--reusar', action='store_true', help='não regera os dados se --banco já existir')
+    p.add_argument('--saida', help='grava os resultados em JSON neste arquivo')
+    p.add_argument('--comparar', help='JSON de uma execução anterior para comparar')
+    p.add_argument('--sem-partida', action='store_true', help='não mede a partida a frio do app.py')
+    args = p.parse_args(argv)
+
+    caminho = args.banco or os.path.join(tempfile.mkdtemp(prefix='bench_atend_'), 'atendimentos.db')
+    existia = os.path.exists(caminho)
+    if existia and not args.reusar:
+        p.error(f'{caminho} já existe; use --reusar ou outro --banco')
+    banco.configurar(caminho)
+    banco.inicializar()
+
+    t = time.perf_counter()
+    if not existia:
+        gerar_dados(args.linhas, args.usuarios, args.funcoes, args.anos, args.semente)
+    total = banco.leitura().execute('SELECT count(*) FROM atendimentos').fetchone()[0]
+    print(f'banco: {caminho} ({total} atendimentos, preparado em {time.perf_counter() - t:.1f}s)\n', file=sys.stderr)
+
+    resultado = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('saida', 'comparar')},
+        'ambiente': {'python': platform.python_version(), 'pandas': pd.__version__,
+                     'sqlite': sqlite3.sqlite_version, 'plataforma': platform.platform()},
+        'atendimentos': total,
+        'casos': executar(args) + ([] if args.sem_partida else [medir_partida(args.repeticoes)]),
+    }
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(resultado, ensure_ascii=False))
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
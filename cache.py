@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+
+import banco
+
+
+# --- CACHE LRU COM GERAÇÃO DE DADOS ---
+# Compartilhado por todas as sessões do processo. Toda escrita no banco chama
+# invalidar(), que incrementa a geração: entradas de gerações anteriores deixam de
+# ser encontradas. Escritas de outros processos (api.py, scripts) não passam por aqui:
+# com versao, cada consulta compara antes a versão dos dados do banco e invalida se
+# ela mudou, então um dado antigo não é servido depois de um salvamento em lugar algum.
+# Os valores são compartilhados entre sessões e não devem ser modificados.
+# Com max_bytes, os valores (bytes) também são limitados pelo tamanho total.
+class CacheLRU:
+    def __init__(self, max_itens=128, max_bytes=None, versao=None):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.versao = versao  # callable com a versão atual dos dados (banco.versao_dados)
+        self._versao_vista = None
+        self.geracao = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.despejos = 0
+        self.bytes = 0
+        self._itens = OrderedDict()  # (geracao, chave) -> (valor, tamanho)
+        self._trava = threading.Lock()
+
+    def obter(self, chave, carregar, geracao=None):
+        # geracao: a dos dados usados por carregar(), quando capturados antes (ex.: download
+        # gerado em outra thread a partir do DataFrame que estava na tela)
+        versao = self.versao() if self.versao is not None else None
+        with self._trava:
+            if versao != self._versao_vista:
+                self._versao_vista = versao
+                self._invalidar()
+            if geracao is None:
+                geracao = self.geracao
+            item = self._itens.get((geracao, chave))
+            if item is not None:
+                self._itens.move_to_end((geracao, chave))
+                self.acertos += 1
+                return item[0]
+            self.falhas += 1
+
+        valor = carregar()
+
+        with self._trava:
+            # Se houve escrita durante a leitura, o valor já nasce velho: não guarda
+            tamanho = len(valor) if self.max_bytes is not None else 0
+            if geracao == self.geracao and (self.max_bytes is None or tamanho <= self.max_bytes):
+                antigo = self._itens.pop((geracao, chave), None)
+                if antigo is not None:
+                    self.bytes -= antigo[1]
+                self._itens[(geracao, chave)] = (valor, tamanho)
+                self.bytes += tamanho
+                while len(self._itens) > self.max_itens or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                    self.bytes -= self._itens.popitem(last=False)[1][1]
+                    self.despejos += 1
+        return valor
+
+    def invalidar(self):
+        with self._trava:
+            self._invalidar()
+
+    def _invalidar(self):
+        self.geracao += 1
+        self._itens.clear()
+        self.bytes = 0
+
+    def estatisticas(self):
+        with self._trava:
+            total = self.acertos + self.falhas
+            return {
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': self.acertos / total if total else 0.0,
+                'despejos': self.despejos,
+                'itens': len(self._itens),
+                'max_itens': self.max_itens,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'geracao': self.geracao,
+            }
+
+
+# Instâncias únicas do processo
+leituras = CacheLRU(max_itens=128, versao=banco.versao_dados)  # funções e atendimentos
+exportacoes = CacheLRU(max_itens=32, max_bytes=64 * 1024 * 1024, versao=banco.versao_dados)  # arquivos Excel/PDF gerados
+
+def invalidar():
+    # Chamado após toda escrita em funcoes/atendimentos
+    leituras.invalidar()
+    exportacoes.invalidar()
@@ -0,0 +1,127 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import banco
+
+# --- CONFIGURAÇÃO ---
+# Desligada, cada função instrumentada custa só um teste de flag antes da chamada original
+_ativo = os.environ.get('ATENDIMENTOS_DESEMPENHO', '') not in ('', '0')
+TAMANHO_BUFFER = 5000
+
+_eventos = deque(maxlen=TAMANHO_BUFFER)  # anel com os eventos mais recentes
+_local = threading.local()
+_log = logging.getLogger('atendimentos.desempenho')  # um JSON por evento (nível INFO)
+
+
+# --- CONTAGEM DE CONSULTAS ---
+def _rastrear(sql):
+    # Chamado pelo sqlite3 na thread que executa o comando; "--" são subcomandos de trigger
+    if not sql.startswith('--'):
+        _local.consultas = getattr(_local, 'consultas', 0) + 1
+
+def _consultas():
+    return getattr(_local, 'consultas', 0)
+
+def escrever(tarefa):
+    # banco.escrever() roda a tarefa na thread gravadora, cujas consultas não entrariam na
+    # contagem de quem pediu (salvar/atualizar/excluir apareceriam com 0): soma-as aqui
+    if not _ativo:
+        return banco.escrever(tarefa)
+    quem_pede, contadas = threading.get_ident(), []
+    def contar(conn):
+        antes = _consultas()
+        try: return tarefa(conn)
+        finally:
+            if threading.get_ident() != quem_pede: contadas.append(_consultas() - antes)
+    try:
+        return banco.escrever(contar)
+    finally:
+        _local.consultas = _consultas() + sum(contadas)
+
+
+# --- LIGA/DESLIGA ---
+def ativo():
+    return _ativo
+
+def ativar(ligar=True):
+    global _ativo
+    _ativo = bool(ligar)
+    banco.definir_rastreio(_rastrear if _ativo else None)
+
+def limpar():
+    _eventos.clear()
+
+
+# --- REGISTRO ---
+def _registrar(nome, tipo, inicio, consultas, linhas=None, erro=None):
+    evento = {'ts': time.time(), 'nome': nome, 'tipo': tipo, 'ms': (time.perf_counter() - inicio) * 1000,
+              'consultas': _consultas() - consultas, 'linhas': linhas, 'thread': threading.current_thread().name}
+    if erro is not None: evento['erro'] = erro
+    _eventos.append(evento)
+    if _log.isEnabledFor(logging.INFO):
+        _log.info(json.dumps(evento, ensure_ascii=False))
+
+def _linhas(resultado):
+    if isinstance(resultado, tuple) and resultado: resultado = resultado[0]
+    if isinstance(resultado, (bool, dict)) or not hasattr(resultado, '__len__'): return None
+    return len(resultado)
+
+def instrumentar(func):
+    # Decorador para as funções de banco do app: tempo, consultas SQL e linhas devolvidas
+    nome = func.__name__
+    @functools.wraps(func)
+    def envolvida(*args, **kwargs):
+        if not _ativo:
+            return func(*args, **kwargs)
+        inicio, consultas = time.perf_counter(), _consultas()
+        try:
+            resultado = func(*args, **kwargs)
+        except Exception as e:
+            _registrar(nome, 'db', inicio, consultas, erro=type(e).__name__)
+            raise
+        _registrar(nome, 'db', inicio, consultas, _linhas(resultado))
+        return resultado
+    return envolvida
+
+def iniciar_tela(nome):
+    # Par iniciar_tela/finalizar_tela em volta de cada tela; st.rerun() interrompe o script
+    # antes do finalizar, e essa execução simplesmente não é registrada
+    if not _ativo:
+        return None
+    return (nome, time.perf_counter(), _consultas())
+
+def finalizar_tela(marca):
+    if marca is not None:
+        _registrar(marca[0], 'tela', marca[1], marca[2])
+
+
+# --- CONSULTA ---
+def _percentil(valores, p):
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+def resumo():
+    grupos = {}
+    for ev in list(_eventos):
+        grupos.setdefault((ev['tipo'], ev['nome']), []).append(ev)
+    linhas = []
+    for (tipo, nome), evs in sorted(grupos.items()):
+        tempos = sorted(ev['ms'] for ev in evs)
+        linhas.append({'tipo': tipo, 'nome': nome, 'chamadas': len(evs),
+                       'consultas': sum(ev['consultas'] for ev in evs),
+                       'linhas': sum(ev['linhas'] or 0 for ev in evs),
+                       'erros': sum('erro' in ev for ev in evs),
+                       'p50_ms': _percentil(tempos, 50), 'p95_ms': _percentil(tempos, 95),
+                       'p99_ms': _percentil(tempos, 99), 'max_ms': tempos[-1]})
+    return linhas
+
+def exportar_jsonl():
+    return ''.join(json.dumps(ev, ensure_ascii=False) + '\n' for ev in list(_eventos))
+
+
+if _ativo:
+    ativar()
@@ -0,0 +1,92 @@
+import heapq
+from bisect import bisect_left
+from itertools import accumulate
+
+
+# --- AGENDA DE UM PROFISSIONAL ---
+# Intervalos [inicio, termino) ordenados por inicio, com o maior término acumulado até
+# cada posição. Quem cruza [ini, fim) está antes de bisect(inicios, fim); andando para
+# trás a partir dali, a busca para assim que o maior término acumulado não passa de ini.
+# Ou seja: O(log n) mais os conflitos encontrados, sem percorrer o histórico inteiro.
+class Agenda:
+    def __init__(self, intervalos=()):
+        itens = sorted(intervalos)  # (inicio, termino, id)
+        self.inicios = [i[0] for i in itens]
+        self.terminos = [i[1] for i in itens]
+        self.ids = [i[2] for i in itens]
+        self._maximos = list(accumulate(self.terminos, max))
+        self._posicao = dict(zip(self.ids, self.inicios))  # id -> inicio, para achar a posição
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _recalcular(self, pos):
+        anterior = self._maximos[pos - 1:pos]
+        self._maximos[pos:] = list(accumulate(anterior + self.terminos[pos:], max))[len(anterior):]
+
+    def adicionar(self, id_, inicio, termino):
+        pos = bisect_left(self.inicios, inicio)
+        self.inicios.insert(pos, inicio)
+        self.terminos.insert(pos, termino)
+        self.ids.insert(pos, id_)
+        self._maximos.insert(pos, termino)
+        self._posicao[id_] = inicio
+        self._recalcular(pos)
+
+    def remover(self, id_):
+        inicio = self._posicao.pop(id_, None)
+        if inicio is None: return
+        pos = bisect_left(self.inicios, inicio)
+        while self.ids[pos] != id_: pos += 1
+        for lista in (self.inicios, self.terminos, self.ids, self._maximos):
+            del lista[pos]
+        if pos < len(self.ids): self._recalcular(pos)
+
+    def conflitos(self, inicio, termino, ignorar=None):
+        # [(id, inicio, termino)] dos intervalos que cruzam [inicio, termino)
+        achados = []
+        pos = bisect_left(self.inicios, termino) - 1
+        while pos >= 0 and self._maximos[pos] > inicio:
+            if self.terminos[pos] > inicio and self.ids[pos] != ignorar:
+                achados.append((self.ids[pos], self.inicios[pos], self.terminos[pos]))
+            pos -= 1
+        return achados[::-1]
+
+
+# --- ÍNDICE POR USUÁRIO ---
+# Agendas carregadas sob demanda, uma por usuario_responsavel, e a posição (seq) do log
+# de mudanças do banco até onde estão em dia. Quem sincroniza é o servico.py.
+class Indice:
+    def __init__(self):
+        self.origem = None  # Banco de onde as agendas foram lidas
+        self.seq = 0
+        self.agendas = {}
+
+    def limpar(self, origem=None, seq=0):
+        self.origem, self.seq = origem, seq
+        self.agendas.clear()
+
+    def aplicar(self, ids, linhas):
+        # ids: alterados desde self.seq; linhas: (id, usuario, inicio, termino) atuais dos que ainda existem
+        for agenda in self.agendas.values():
+            for id_ in ids: agenda.remover(id_)
+        for id_, usuario, inicio, termino in linhas:
+            agenda = self.agendas.get(usuario)
+            if agenda is not None and inicio is not None and termino is not None:
+                agenda.adicionar(id_, inicio, termino)
+
+
+# --- VARREDURA ---
+def sobreposicoes(linhas):
+    # linhas: (usuario, inicio, termino, id) ordenadas por usuario e inicio. Uma passada só:
+    # um heap com os intervalos ainda abertos (por término); cada novo intervalo se sobrepõe
+    # a todos os que continuam abertos quando ele começa. Gera um par por sobreposição.
+    atual, abertos = object(), []
+    for usuario, inicio, termino, id_ in linhas:
+        if usuario != atual:
+            atual, abertos = usuario, []
+        while abertos and abertos[0][0] <= inicio:
+            heapq.heappop(abertos)
+        for fim_a, ini_a, id_a in abertos:
+            yield usuario, id_a, ini_a, fim_a, id_, inicio, termino
+        heapq.heappush(abertos, (termino, inicio, id_))
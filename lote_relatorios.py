@@ -0,0 +1,136 @@
+# Geração em lote dos relatórios do mês, um por profissional (e opcionalmente por função).
+# Os atendimentos do mês são lidos uma única vez, separados por usuario_responsavel e
+# renderizados em paralelo (um processo por núcleo) com os mesmos geradores de PDF/Excel
+# do app. Cada execução grava os arquivos e um manifest.json no diretório de saída:
+#
+#     python lote_relatorios.py --ano 2024 --mes 5 --saida relatorios_2024_05
+#     python lote_relatorios.py --por-funcao --formatos pdf --processos 4
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+import banco
+import servico
+from relatorios import MESES, criar_excel_relatorio, criar_pdf_relatorio
+
+FORMATOS = ('pdf', 'xlsx')
+ACESSO_LOTE = servico.Acesso('lote', 'admin')  # o lote enxerga todos os usuários
+
+
+# --- TAREFAS ---
+def _nome_arquivo(*partes):
+    return '_'.join(re.sub(r'[^\w.-]+', '_', str(p)).strip('_') or 'sem_nome' for p in partes)
+
+def _metricas(df):
+    # Mesmos números do resumo_mensal (valor_total e duração em horas)
+    return {'valor': float(df['valor_total'].sum()),
+            'horas': float((df['termino'] - df['inicio']).dt.total_seconds().sum() / 3600), 'qtd': len(df)}
+
+def montar_tarefas(df, ano, mes, saida, formatos, por_funcao=False):
+    chaves = ['usuario_responsavel', 'funcao'] if por_funcao else ['usuario_responsavel']
+    tarefas, usados = [], set()
+    for chave, grupo in df.groupby(chaves, observed=True, sort=True):
+        usuario, funcao = (chave[0], chave[1]) if por_funcao else (chave[0], None)
+        base = nome = _nome_arquivo(f'{ano}-{mes:02d}', usuario, *([funcao] if por_funcao else []))
+        # "ana.souza" e "ana souza" (ou "Ana" e "ana", em disco sem diferença de caixa) dariam o
+        # mesmo arquivo: os seguintes ganham um sufixo em vez de sobrescrever o anterior
+        contador = 1
+        while nome.lower() in usados:
+            contador += 1
+            nome = f'{base}_{contador}'
+        usados.add(nome.lower())
+        tarefas.append({'df': grupo, 'ano': ano, 'mes': mes, 'usuario': usuario, 'funcao': funcao,
+                        'caminho': os.path.join(saida, nome), 'formatos': formatos})
+    # Maiores primeiro: os relatórios grandes não ficam para o fim, com núcleos ociosos
+    tarefas.sort(key=lambda t: len(t['df']), reverse=True)
+    return tarefas
+
+def gerar(tarefa):
+    # Roda no processo filho: renderiza e grava os arquivos de um usuário/função
+    df, metricas = tarefa['df'], _metricas(tarefa['df'])
+    item = {'usuario': tarefa['usuario'], 'funcao': tarefa['funcao'], **metricas, 'arquivos': []}
+    for formato in tarefa['formatos']:
+        if formato == 'pdf':
+            dados = criar_pdf_relatorio(df, MESES[tarefa['mes']], tarefa['ano'], metricas, tarefa['usuario'],
+                                        tarefa['funcao'] or 'Todas')
+        else:
+            dados = criar_excel_relatorio(df)
+        caminho = f"{tarefa['caminho']}.{formato}"
+        with open(caminho + '.tmp', 'wb') as f: f.write(dados)
+        os.replace(caminho + '.tmp', caminho)
+        item['arquivos'].append({'formato': formato, 'arquivo': os.path.basename(caminho), 'bytes': len(dados),
+                                 'sha256': hashlib.sha256(dados).hexdigest()})
+    return item
+
+
+# --- EXECUÇÃO ---
+def executar(tarefas, processos):
+    itens, erros = [], []
+    if processos <= 1:
+        for t in tarefas:
+            try: itens.append(gerar(t))
+            except Exception as e: erros.append({'usuario': t['usuario'], 'funcao': t['funcao'], 'erro': repr(e)})
+        return itens, erros
+    with ProcessPoolExecutor(max_workers=processos) as pool:
+        futuros = {pool.submit(gerar, t): t for t in tarefas}
+        for futuro in as_completed(futuros):
+            t = futuros[futuro]
+            try: itens.append(futuro.result())
+            except Exception as e: erros.append({'usuario': t['usuario'], 'funcao': t['funcao'], 'erro': repr(e)})
+    return itens, erros
+
+def _mes_anterior():
+    hoje = date.today()
+    return (hoje.year - 1, 12) if hoje.month == 1 else (hoje.year, hoje.month - 1)
+
+
+def main(argv=None):
+    ano_padrao, mes_padrao = _mes_anterior()
+    p = argparse.ArgumentParser(description='Relatórios do mês em lote, um por profissional')
+    p.add_argument('--ano', type=int, default=ano_padrao)
+    p.add_argument('--mes', type=int, default=mes_padrao, choices=range(1, 13), metavar='1-12')
+    p.add_argument('--saida', help='diretório de saída (padrão: relatorios_AAAA_MM)')
+    p.add_argument('--por-funcao', action='store_true', help='um relatório por usuário e função')
+    p.add_argument('--formatos', default=','.join(FORMATOS), help='pdf, xlsx ou pdf,xlsx')
+    p.add_argument('--usuarios', help='lista separada por vírgula (padrão: todos com atendimentos no mês)')
+    p.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    p.add_argument('--banco', default=banco.CAMINHO_PADRAO, help='arquivo SQLite (o mesmo do app)')
+    args = p.parse_args(argv)
+    formatos = [f.strip() for f in args.formatos.split(',') if f.strip()]
+    if not formatos or set(formatos) - set(FORMATOS):
+        p.error(f'--formatos aceita {", ".join(FORMATOS)}')
+    saida = args.saida or f'relatorios_{args.ano}_{args.mes:02d}'
+    os.makedirs(saida, exist_ok=True)
+
+    banco.configurar(args.banco)
+    banco.inicializar()
+    t = time.perf_counter()
+    df = servico.carregar_atendimentos(ACESSO_LOTE, *servico.intervalo_mes(args.ano, args.mes))
+    if args.usuarios and not df.empty:
+        df = df[df['usuario_responsavel'].isin([u.strip() for u in args.usuarios.split(',')])]
+    tarefas = montar_tarefas(df, args.ano, args.mes, saida, formatos, args.por_funcao) if not df.empty else []
+    print(f'{len(df)} atendimentos de {MESES[args.mes]}/{args.ano} em {time.perf_counter() - t:.2f}s; '
+          f'{len(tarefas)} relatórios em {args.processos} processos', file=sys.stderr)
+
+    itens, erros = executar(tarefas, args.processos)
+    itens.sort(key=lambda i: (i['usuario'], i['funcao'] or ''))
+    manifesto = {
+        'ano': args.ano, 'mes': args.mes, 'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'por_funcao': args.por_funcao, 'formatos': formatos, 'atendimentos': len(df),
+        'duracao_s': round(time.perf_counter() - t, 3), 'relatorios': itens, 'erros': erros,
+    }
+    with open(os.path.join(saida, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    print(f'{len(itens)} relatórios gravados em {saida} ({manifesto["duracao_s"]:.1f}s)'
+          + (f'; {len(erros)} com erro (ver manifest.json)' if erros else ''), file=sys.stderr)
+    return 1 if erros else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import csv
+import gzip
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+MESES = {1:"Janeiro", 2:"Fevereiro", 3:"Marco", 4:"Abril", 5:"Maio", 6:"Junho",
+         7:"Julho", 8:"Agosto", 9:"Setembro", 10:"Outubro", 11:"Novembro", 12:"Dezembro"}
+
+# --- LAYOUT DA TABELA ---
+COLUNAS_PDF = ['id', 'inicio', 'termino', 'paciente', 'periodo', 'funcao', 'detalhes', 'valor_total', 'usuario_responsavel']
+CABECALHOS_PDF = ['ID', 'Inicio', 'Termino', 'Paciente', 'Periodo', 'Funcao', 'Detalhes', 'Valor', 'Resp.']
+LARGURAS_PDF = [10, 28, 28, 40, 22, 30, 50, 25, 35]
+ALINHAMENTOS_PDF = ['C', 'C', 'C', 'L', 'C', 'L', 'L', 'R', 'L']
+
+
+# --- PDF ---
+# fpdf (e o xlsxwriter, mais abaixo) só é importado na primeira exportação: não pesa na
+# partida do app, que renderiza o login sem nenhum gerador de relatório carregado.
+_ClassePDF = None
+
+def _novo_pdf(*args):
+    global _ClassePDF
+    if _ClassePDF is not None:
+        return _ClassePDF(*args)
+    from fpdf import FPDF
+
+    class PDF(FPDF):
+        def __init__(self, *args, **kwargs):
+            self._conteudo = []
+            super().__init__(*args, **kwargs)
+
+        def header(self):
+            self.set_fill_color(77, 166, 255)
+            self.rect(0, 0, 297, 25, 'F')
+            self.set_font('Arial', 'B', 15)
+            self.set_text_color(255, 255, 255)
+            self.cell(0, 10, 'Relatório de Atendimentos', 0, 1, 'C')
+            self.ln(5)
+        def footer(self):
+            self.set_y(-15)
+            self.set_font('Arial', 'I', 8)
+            self.set_text_color(128, 128, 128)
+            self.cell(0, 10, f'Pagina {self.page_no()}', 0, 0, 'C')
+
+        # O FPDF concatena cada comando na string da página (custo quadrático no tamanho
+        # da página); aqui os comandos são acumulados em lista e unidos ao fechar a página.
+        def _out(self, s):
+            if self.state == 2 and isinstance(s, str):
+                self._conteudo.append(s)
+            else:
+                super()._out(s)
+        def _endpage(self):
+            if self._conteudo:
+                self._conteudo.append('')
+                self.pages[self.page] += '\n'.join(self._conteudo)
+                self._conteudo = []
+            super()._endpage()
+
+    _ClassePDF = PDF
+    return PDF(*args)
+
+
+# --- PREPARAÇÃO DAS COLUNAS ---
+def _latin1(serie):
+    # Sanitiza só os valores distintos e mapeia de volta (funções, períodos e
+    # responsáveis se repetem em quase todas as linhas)
+    serie = serie.astype(object).fillna('').astype(str)
+    mapa = {v: v.encode('latin-1', 'replace').decode('latin-1') for v in serie.unique()}
+    return serie.map(mapa)
+
+def _truncar(serie, limite, sufixo=''):
+    longos = serie.str.len() > limite
+    return serie.where(~longos, serie.str[:limite] + sufixo)
+
+def preparar_colunas_pdf(df):
+    return [
+        df['id'].astype(str).tolist(),
+        df['inicio'].dt.strftime('%d/%m %H:%M').tolist(),
+        df['termino'].dt.strftime('%d/%m %H:%M').tolist(),
+        _latin1(df['paciente']).str[:22].tolist(),
+        _latin1(df['periodo']).tolist(),
+        _latin1(df['funcao']).str[:20].tolist(),
+        _truncar(_latin1(df['detalhes']), 30, '...').tolist(),
+        [f'{v:,.2f}' for v in df['valor_total'].fillna(0).tolist()],
+        _latin1(df['usuario_responsavel']).tolist(),
+    ]
+
+
+# --- RELATÓRIO PDF ---
+def criar_pdf_relatorio(df, mes_nome, ano, metricas, usuario, filtro_funcao):
+    pdf = _novo_pdf('L', 'mm', 'A4')
+    pdf.add_page()
+
+    pdf.set_font('Arial', 'B', 12)
+    pdf.set_text_color(0, 0, 0)
+    pdf.cell(0, 10, f'Periodo: {mes_nome}/{ano} - Resp: {usuario}', 0, 1, 'L')
+
+    pdf.set_fill_color(240, 240, 240)
+    pdf.rect(10, 35, 277, 20, 'F')
+    pdf.set_y(40)
+    pdf.set_font('Arial', '', 11)
+    pdf.cell(0, 10, f"Faturamento: R$ {metricas['valor']:,.2f}   Horas: {metricas['horas']:.1f} h   Qtd: {metricas['qtd']}", 0, 1, 'C')
+    pdf.ln(15)
+
+    pdf.set_font('Arial', 'B', 8)
+    pdf.set_fill_color(200, 220, 255)
+    for w, h in zip(LARGURAS_PDF, CABECALHOS_PDF): pdf.cell(w, 10, h, 1, 0, 'C', 1)
+    pdf.ln()
+
+    pdf.set_font('Arial', '', 7)
+    pdf.set_fill_color(245, 245, 245)
+
+    # Laço enxuto: as colunas já chegam formatadas, só resta emitir as células
+    layout = list(zip(LARGURAS_PDF, ALINHAMENTOS_PDF))
+    cell, ln = pdf.cell, pdf.ln
+    fill = False
+    for linha in zip(*preparar_colunas_pdf(df)):
+        for (w, alinhamento), txt in zip(layout, linha):
+            cell(w, 8, txt, 1, 0, alinhamento, fill)
+        ln()
+        fill = not fill
+
+    return pdf.output(dest='S').encode('latin-1')
+
+
+# --- RELATÓRIO EXCEL ---
+def criar_excel_relatorio(df):
+    buffer_excel = io.BytesIO()
+    with pd.ExcelWriter(buffer_excel, engine='xlsxwriter') as writer: df.to_excel(writer, index=False)
+    return buffer_excel.getvalue()
+
+
+# --- EXPORTAÇÃO EM FLUXO ---
+# Para períodos longos: as linhas chegam em lotes de um cursor (servico.exportar_atendimentos)
+# e vão direto para um arquivo temporário, sem DataFrame. No modo constant_memory o xlsxwriter
+# descarrega cada linha assim que passa para a seguinte; o CSV sai comprimido em gzip.
+FORMATOS_EXPORTACAO = {'xlsx': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+                       'csv.gz': ('.csv.gz', 'application/gzip')}
+MAX_LINHAS_EXCEL = 1_048_575  # limite da planilha, fora o cabeçalho
+
+def escrever_excel_lotes(colunas, lotes, destino):
+    import xlsxwriter
+    wb = xlsxwriter.Workbook(destino, {'constant_memory': True, 'tmpdir': os.path.dirname(destino),
+                                       'default_date_format': 'dd/mm/yyyy hh:mm', 'strings_to_urls': False})
+    ws = wb.add_worksheet('Atendimentos')
+    ws.write_row(0, 0, colunas, wb.add_format({'bold': True}))
+    if 'valor_total' in colunas:
+        i = colunas.index('valor_total')
+        ws.set_column(i, i, 12, wb.add_format({'num_format': '#,##0.00'}))
+    for i in [colunas.index(c) for c in ('inicio', 'termino') if c in colunas]:
+        ws.set_column(i, i, 16)
+    linha = 0
+    try:
+        for lote in lotes:
+            if linha + len(lote) > MAX_LINHAS_EXCEL:
+                raise ValueError(f'Mais de {MAX_LINHAS_EXCEL} linhas não cabem numa planilha: use CSV (gzip).')
+            for registro in lote:
+                linha += 1
+                ws.write_row(linha, 0, registro)
+    finally:
+        wb.close()
+    return linha
+
+def escrever_csv_gz_lotes(colunas, lotes, destino):
+    linhas = 0
+    with gzip.open(destino, 'wt', encoding='utf-8-sig', newline='', compresslevel=6) as f:
+        escritor = csv.writer(f)
+        escritor.writerow(colunas)
+        for lote in lotes:
+            escritor.writerows(lote)
+            linhas += len(lote)
+    return linhas
+
+def exportar_lotes(colunas, lotes, formato):
+    # Grava no formato pedido num arquivo temporário e devolve o caminho (quem chama apaga)
+    sufixo, _ = FORMATOS_EXPORTACAO[formato]
+    fd, caminho = tempfile.mkstemp(prefix='exportacao_', suffix=sufixo)
+    os.close(fd)
+    try:
+        (escrever_excel_lotes if formato == 'xlsx' else escrever_csv_gz_lotes)(colunas, lotes, caminho)
+    except BaseException:
+        os.remove(caminho)
+        raise
+    return caminho
+
+def ler_e_apagar(caminho):
+    try:
+        with open(caminho, 'rb') as f: return f.read()
+    finally:
+        os.remove(caminho)
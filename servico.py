@@ -0,0 +1,618 @@
+import io
+import sqlite3
+from datetime import datetime, time, timedelta
+
+import pandas as pd
+
+import banco
+import cache
+import desempenho
+import intervalos
+from autenticacao import Acesso, autenticar, check_hashes, make_hashes
+
+# --- SERVIÇO DE DADOS ---
+# Armazenamento, preços, períodos e regras de acesso, sem depender do Streamlit: usado
+# pelo app.py, pelo api.py e por scripts. Quem pede é sempre explícito (Acesso), e as
+# regras valem igual para todos: usuário comum só lê e altera os próprios atendimentos.
+# Acesso e autenticar vêm do autenticacao.py (leve, usado na tela de login) e seguem
+# disponíveis aqui para o api.py e os scripts.
+def _exigir_admin(acesso):
+    if acesso.tipo != 'admin':
+        raise PermissionError('Acesso restrito ao administrador.')
+
+
+# --- LÓGICA DE PERÍODO E PREÇO ---
+def calcular_periodo(hora_inicio):
+    h = hora_inicio.hour
+    if 0 <= h < 6: return "Madrugada"
+    elif 6 <= h < 12: return "Manhã"
+    elif 12 <= h < 18: return "Tarde"
+    else: return "Noite"
+
+def calcular_valor(inicio, termino, valor_hora):
+    return (termino - inicio).total_seconds() / 3600 * valor_hora
+
+def _preco(conn, funcao):
+    # Busca pelo índice idx_funcoes_nome; nomes repetidos resolvem para a função mais antiga
+    row = conn.execute('SELECT id, valor_hora FROM funcoes WHERE nome = ? ORDER BY id LIMIT 1', (funcao,)).fetchone()
+    if row is None: raise ValueError(f"Função não cadastrada: {funcao}")
+    return row
+
+def _validar_atendimento(inicio, termino, paciente):
+    if not paciente: raise ValueError("Nome do paciente obrigatório.")
+    if termino <= inicio: raise ValueError("Término deve ser depois do início.")
+
+
+# --- USUÁRIOS ---
+# @desempenho.instrumentar: tempo, consultas e linhas de cada chamada (painel em Administração)
+@desempenho.instrumentar
+def criar_usuario(acesso, username, password, tipo):
+    _exigir_admin(acesso)
+    try:
+        with banco.transacao() as conn:
+            conn.execute('INSERT INTO usuarios VALUES (?, ?, ?)', (username, make_hashes(password), tipo))
+        return True
+    except sqlite3.Error: return False
+
+@desempenho.instrumentar
+def listar_usuarios(acesso):
+    _exigir_admin(acesso)
+    return pd.read_sql('SELECT username, tipo FROM usuarios', banco.leitura())
+
+@desempenho.instrumentar
+def excluir_usuario(acesso, username):
+    _exigir_admin(acesso)
+    with banco.transacao() as conn:
+        conn.execute('DELETE FROM usuarios WHERE username = ?', (username,))
+
+
+# --- FUNÇÕES (CARGOS) ---
+@desempenho.instrumentar
+def carregar_funcoes():
+    return cache.leituras.obter(('funcoes',), lambda: pd.read_sql('SELECT * FROM funcoes', banco.leitura()))
+
+@desempenho.instrumentar
+def salvar_funcao(nome, valor):
+    with banco.transacao() as conn:
+        conn.execute('INSERT INTO funcoes (nome, valor_hora) VALUES (?, ?)', (nome, valor))
+    cache.invalidar()
+
+@desempenho.instrumentar
+def atualizar_funcao(id_func, nome, valor):
+    # Renomear leva o novo nome aos atendimentos da função (um UPDATE só); o valor_total
+    # já gravado só muda com reprecificar_atendimentos
+    with banco.transacao() as conn:
+        conn.execute('UPDATE funcoes SET nome=?, valor_hora=? WHERE id=?', (nome, valor, id_func))
+        banco.atualizar_em_massa(conn, 'funcao = ?', 'funcao_id = ? AND funcao IS NOT ?', (id_func, nome), valores=(nome,))
+    cache.invalidar()
+
+@desempenho.instrumentar
+def reprecificar_atendimentos(acesso, id_func=None, inicio=None, fim=None):
+    # Recalcula valor_total = duração × valor_hora atual, num único UPDATE ... FROM funcoes,
+    # para os atendimentos com início em [inicio, fim) da função (ou de todas). Devolve a quantidade.
+    _exigir_admin(acesso)
+    where, params = ['f.id = atendimentos.funcao_id'], []
+    if id_func is not None: where.append('atendimentos.funcao_id = ?'); params.append(id_func)
+    if inicio is not None: where.append('atendimentos.inicio >= ?'); params.append(banco.para_epoch(inicio))
+    if fim is not None: where.append('atendimentos.inicio < ?'); params.append(banco.para_epoch(fim))
+    with banco.transacao() as conn:
+        qtd = banco.atualizar_em_massa(
+            conn, 'valor_total = (atendimentos.termino - atendimentos.inicio) / 3600.0 * f.valor_hora',
+            ' AND '.join(where), params, juncao='funcoes f')
+    cache.invalidar()
+    return qtd
+
+@desempenho.instrumentar
+def excluir_funcao(id_func):
+    with banco.transacao() as conn:
+        conn.execute('DELETE FROM funcoes WHERE id=?', (id_func,))
+    cache.invalidar()
+
+
+# --- CONFLITOS DE HORÁRIO ---
+# Um profissional não pode ter dois atendimentos que se cruzam (seria pago duas vezes).
+# A checagem roda dentro da transação de escrita, sobre agendas em memória (intervalos.py)
+# que acompanham o log de mudanças do banco: antes de cada checagem são relidos só os ids
+# alterados desde a anterior, por este ou por outro processo. Mudanças demais de uma vez
+# (importação, reprecificação) descartam as agendas, recarregadas pelo índice sob demanda.
+LIMIAR_RECARGA = 1000
+_indice = intervalos.Indice()
+banco.ao_desfazer(_indice.limpar)  # a transação desfeita pode ter deixado linhas dela nas agendas
+
+def _sincronizar(conn):
+    origem = banco.obter_banco()
+    seq = conn.execute("SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'mudancas'").fetchone()[0]
+    if _indice.origem is not origem or seq < _indice.seq:
+        _indice.limpar(origem, seq)
+    elif seq > _indice.seq:
+        # Log limpo além da nossa posição (instantâneo analítico): não dá para saber o que mudou
+        primeiro = conn.execute('SELECT min(seq) FROM mudancas WHERE seq > ?', (_indice.seq,)).fetchone()[0]
+        ids = [row[0] for row in conn.execute('SELECT DISTINCT id FROM mudancas WHERE seq > ? LIMIT ?',
+                                              (_indice.seq, LIMIAR_RECARGA + 1))]
+        if primeiro != _indice.seq + 1 or len(ids) > LIMIAR_RECARGA:
+            _indice.limpar(origem, seq)
+        else:
+            linhas = conn.execute(f"SELECT id, usuario_responsavel, inicio, termino FROM atendimentos "
+                                  f"WHERE id IN ({', '.join('?' * len(ids))})", ids).fetchall()
+            _indice.aplicar(ids, linhas)
+            _indice.seq = seq
+
+def _agenda(conn, usuario):
+    agenda = _indice.agendas.get(usuario)
+    if agenda is None:
+        # Varre só a faixa do usuário no índice (usuario_responsavel, inicio, termino)
+        agenda = _indice.agendas[usuario] = intervalos.Agenda(conn.execute(
+            '''SELECT inicio, termino, id FROM atendimentos
+               WHERE usuario_responsavel = ? AND inicio IS NOT NULL AND termino IS NOT NULL''', (usuario,)))
+    return agenda
+
+def _descrever_conflito(id_atend, inicio, termino):
+    inicio, termino = banco.EPOCH + timedelta(seconds=inicio), banco.EPOCH + timedelta(seconds=termino)
+    return f"{id_atend} ({inicio.strftime('%d/%m/%Y %H:%M')} às {termino.strftime('%d/%m %H:%M')})"
+
+def _conflitos_arquivados(conn, usuario, inicio, termino):
+    # Anos arquivados são somente leitura. Do ano anterior, se arquivado, só pode cruzar um
+    # atendimento que atravessa a virada do ano: consultado no arquivo por uma conexão de
+    # leitura (ATTACH não roda dentro da transação de escrita)
+    arquivados, ano = banco.arquivos_registrados(conn), banco.ano_epoch(inicio)
+    if ano in arquivados:
+        raise ValueError(f"O ano {ano} está arquivado (somente leitura).")
+    if ano - 1 not in arquivados: return []
+    leitor = banco.leitura()
+    esquema, = banco.anexar(leitor, {ano - 1: arquivados[ano - 1]})
+    return leitor.execute(f'''SELECT id, inicio, termino FROM {esquema}.atendimentos
+                              WHERE usuario_responsavel = ? AND inicio < ? AND termino > ?''', (usuario, termino, inicio)).fetchall()
+
+@desempenho.instrumentar
+def _checar_conflitos(conn, usuario, inicio, termino, ignorar=None):
+    # Deve rodar dentro de transacao(); inicio/termino em epoch; ignorar: o próprio id na edição
+    _sincronizar(conn)
+    achados = _agenda(conn, usuario).conflitos(inicio, termino, ignorar)
+    # Agendas de outro processo podem ainda ter a linha recém-arquivada (arquivar não passa pelo log)
+    vistos = {a[0] for a in achados}
+    achados = [a for a in _conflitos_arquivados(conn, usuario, inicio, termino) if a[0] not in vistos] + achados
+    if achados:
+        lista = ', '.join(_descrever_conflito(*a) for a in achados[:3]) + (f' e mais {len(achados) - 3}' if len(achados) > 3 else '')
+        raise ValueError(f"Conflito de horário de {usuario} com o(s) atendimento(s) {lista}.")
+
+def _conflitos_lote(conn, linhas, numeros):
+    # {posição em linhas: motivo} das linhas que cruzam um atendimento já gravado ou uma linha
+    # anterior do mesmo arquivo (a que começa primeiro fica, as seguintes são rejeitadas)
+    _sincronizar(conn)
+    i_ini, i_fim, i_usu = (banco.COLUNAS_ATENDIMENTO.index(c) for c in ('inicio', 'termino', 'usuario_responsavel'))
+    por_usuario, motivos, arquivados = {}, {}, banco.arquivos_registrados(conn)
+    for pos, linha in enumerate(linhas):
+        if banco.ano_epoch(linha[i_ini]) in arquivados:
+            motivos[pos] = f'ano {banco.ano_epoch(linha[i_ini])} arquivado (somente leitura)'
+            continue
+        por_usuario.setdefault(linha[i_usu], []).append(pos)
+    for usuario, posicoes in por_usuario.items():
+        gravados, novos = _agenda(conn, usuario), intervalos.Agenda()
+        for pos in sorted(posicoes, key=lambda p: linhas[p][i_ini]):
+            inicio, termino = linhas[pos][i_ini], linhas[pos][i_fim]
+            achados = gravados.conflitos(inicio, termino)
+            repetidos = novos.conflitos(inicio, termino) if not achados else []
+            if achados: motivos[pos] = f'conflito de horário com o atendimento {achados[0][0]}'
+            elif repetidos: motivos[pos] = f'conflito de horário com a linha {numeros[repetidos[0][0]]}'
+            else: novos.adicionar(pos, inicio, termino)
+    return motivos
+
+@desempenho.instrumentar
+def auditar_conflitos(acesso):
+    # Todos os pares sobrepostos do mesmo profissional, numa única varredura (sweep line)
+    # na ordem do índice (usuario_responsavel, inicio, termino). Só o banco principal: os
+    # anos arquivados estão fechados.
+    _exigir_admin(acesso)
+    cursor = banco.leitura().execute('''SELECT usuario_responsavel, inicio, termino, id FROM atendimentos
+                                        WHERE inicio IS NOT NULL AND termino IS NOT NULL
+                                        ORDER BY usuario_responsavel, inicio''')
+    df = pd.DataFrame(list(intervalos.sobreposicoes(cursor)),
+                      columns=['usuario_responsavel', 'id_a', 'inicio_a', 'termino_a', 'id_b', 'inicio_b', 'termino_b'])
+    df['minutos'] = (df[['termino_a', 'termino_b']].min(axis=1) - df['inicio_b']) // 60
+    for col in ['inicio_a', 'termino_a', 'inicio_b', 'termino_b']:
+        df[col] = pd.to_datetime(df[col], unit='s')
+    return df
+
+
+# --- ATENDIMENTOS: ESCRITA ---
+# Valor (valor_hora × duração) e período são sempre calculados aqui, com o preço lido
+# dentro da mesma transação que grava o atendimento. Salvar, editar e excluir passam pelo
+# gravador do banco.py (banco.escrever, via desempenho.escrever para que as consultas feitas
+# no gravador contem para quem pediu), que agrupa as escritas simultâneas das sessões.
+def _conferir_dono(conn, acesso, id_atend):
+    row = conn.execute('SELECT usuario_responsavel FROM atendimentos WHERE id = ?', (id_atend,)).fetchone()
+    if row is None: raise LookupError(f"Atendimento {id_atend} não encontrado (anos arquivados são somente leitura).")
+    if acesso.tipo != 'admin' and row[0] != acesso.usuario:
+        raise PermissionError('Atendimento de outro usuário.')
+    return row[0]
+
+@desempenho.instrumentar
+def salvar_atendimento(acesso, inicio, termino, funcao, paciente, detalhes='', usuario=None):
+    # usuario: responsável; só o admin pode registrar em nome de outro. Devolve (id, valor_total).
+    _validar_atendimento(inicio, termino, paciente)
+    if usuario is None or acesso.tipo != 'admin': usuario = acesso.usuario
+    def gravar(conn):
+        id_func, valor_hora = _preco(conn, funcao)
+        _checar_conflitos(conn, usuario, banco.para_epoch(inicio), banco.para_epoch(termino))
+        total = calcular_valor(inicio, termino, valor_hora)
+        c = conn.execute('''INSERT INTO atendimentos (inicio, termino, funcao, funcao_id, valor_total, usuario_responsavel, detalhes, paciente, periodo)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', (banco.para_epoch(inicio), banco.para_epoch(termino), funcao, id_func, total, usuario, detalhes, paciente, calcular_periodo(inicio)))
+        return c.lastrowid, total
+    resultado = desempenho.escrever(gravar)
+    cache.invalidar()
+    return resultado
+
+@desempenho.instrumentar
+def atualizar_atendimento(acesso, id_atend, inicio, termino, funcao, paciente, detalhes=''):
+    _validar_atendimento(inicio, termino, paciente)
+    def gravar(conn):
+        usuario = _conferir_dono(conn, acesso, id_atend)
+        id_func, valor_hora = _preco(conn, funcao)
+        _checar_conflitos(conn, usuario, banco.para_epoch(inicio), banco.para_epoch(termino), ignorar=id_atend)
+        total = calcular_valor(inicio, termino, valor_hora)
+        conn.execute('''UPDATE atendimentos
+                        SET inicio=?, termino=?, funcao=?, funcao_id=?, valor_total=?, detalhes=?, paciente=?, periodo=?
+                        WHERE id=?''',
+                     (banco.para_epoch(inicio), banco.para_epoch(termino), funcao, id_func, total, detalhes, paciente, calcular_periodo(inicio), id_atend))
+        return total
+    total = desempenho.escrever(gravar)
+    cache.invalidar()
+    return total
+
+@desempenho.instrumentar
+def excluir_atendimento(acesso, id_atend):
+    def gravar(conn):
+        _conferir_dono(conn, acesso, id_atend)
+        conn.execute('DELETE FROM atendimentos WHERE id=?', (id_atend,))
+    desempenho.escrever(gravar)
+    cache.invalidar()
+
+
+# --- ATENDIMENTOS: LEITURA ---
+def _filtro_acesso(acesso, usuario=None):
+    # Usuário comum só enxerga os próprios registros, seja qual for o filtro pedido
+    if acesso.tipo == 'admin':
+        return ([], []) if usuario is None else (['usuario_responsavel = ?'], [usuario])
+    return ['usuario_responsavel = ?'], [acesso.usuario]
+
+def _arquivos(inicio=None, fim=None):
+    # Anos arquivados que o intervalo [inicio, fim) (epoch) alcança: {ano: arquivo}
+    todos = cache.leituras.obter(('arquivos',), lambda: banco.arquivos_registrados(banco.leitura()))
+    ano_ini = banco.ano_epoch(inicio) if inicio is not None else None
+    ano_fim = banco.ano_epoch(fim - 1) if fim is not None else None
+    return {ano: arq for ano, arq in todos.items()
+            if (ano_ini is None or ano >= ano_ini) and (ano_fim is None or ano <= ano_fim)}
+
+def intervalo_mes(ano, mes):
+    inicio = datetime(ano, mes, 1)
+    fim = datetime(ano + 1, 1, 1) if mes == 12 else datetime(ano, mes + 1, 1)
+    return inicio, fim
+
+def _consultas_por_bloco(where, params, inicio=None, fim=None, coluna='inicio'):
+    # [(where, params, arquivos)]: uma consulta por bloco de anos arquivados (banco.blocos_arquivos),
+    # cada uma restrita à faixa de inicio do bloco. Na ordem da lista, os resultados saem por inicio
+    consultas = []
+    for desde, ate, bloco in banco.blocos_arquivos(_arquivos(inicio, fim)):
+        w, p = list(where), list(params)
+        if desde is not None: w.append(f'{coluna} >= ?'); p.append(desde)
+        if ate is not None: w.append(f'{coluna} < ?'); p.append(ate)
+        consultas.append((w, p, bloco))
+    return consultas
+
+def _consulta_atendimentos(acesso, inicio=None, fim=None, funcao=None, usuario=None, colunas='*'):
+    # Filtros viram WHERE sobre os índices (usuario_responsavel, inicio, termino), (funcao, inicio) e (inicio)
+    # Anos arquivados alcançados pelo intervalo entram na consulta via UNION ALL. Devolve
+    # [(query, params, arquivos)], uma por bloco de até MAX_ANEXOS anos (quase sempre uma só)
+    where, params = _filtro_acesso(acesso, usuario)
+    inicio = banco.para_epoch(inicio) if inicio is not None else None
+    fim = banco.para_epoch(fim) if fim is not None else None
+    if funcao is not None: where.append('funcao = ?'); params.append(funcao)
+    if inicio is not None: where.append('inicio >= ?'); params.append(inicio)
+    if fim is not None: where.append('inicio < ?'); params.append(fim)
+    consultas = []
+    for w, p, arquivos in _consultas_por_bloco(where, params, inicio, fim):
+        query = f'SELECT {colunas} FROM ' + banco.origem_atendimentos(map(banco.esquema_arquivo, arquivos))
+        if w: query += ' WHERE ' + ' AND '.join(w)
+        consultas.append((query + ' ORDER BY inicio, id', p, arquivos))
+    return consultas
+
+def _chave(consultas):
+    # Chave de cache das consultas; inclui o filtro de acesso (usuário/perfil) via params
+    return tuple((query, tuple(params)) for query, params, _ in consultas)
+
+@desempenho.instrumentar
+def carregar_atendimentos(acesso, inicio=None, fim=None, funcao=None, usuario=None):
+    consultas = _consulta_atendimentos(acesso, inicio, fim, funcao, usuario)
+    return cache.leituras.obter(('atendimentos', _chave(consultas)), lambda: _ler_atendimentos(consultas))
+
+@desempenho.instrumentar
+def _ler_atendimentos(consultas, limite=None):
+    # Blocos lidos em sequência, anexando os anos de cada um; limite: para quando já houver linhas suficientes.
+    # Erros de leitura sobem para quem chamou (e não entram no cache, que só guarda retornos).
+    conn = banco.leitura()
+    partes = []
+    for query, params, arquivos in consultas:
+        if arquivos: banco.anexar(conn, arquivos)
+        partes.append(pd.read_sql(query, conn, params=params))
+        if limite is not None and sum(map(len, partes)) >= limite: break
+    df = partes[0] if len(partes) == 1 else pd.concat(partes, ignore_index=True)
+
+    if not df.empty:
+        # Datas já vêm como inteiros (epoch): conversão numérica, sem parsing de texto
+        df['inicio'] = pd.to_datetime(df['inicio'], unit='s')
+        df['termino'] = pd.to_datetime(df['termino'], unit='s')
+        for col in ['usuario_responsavel', 'detalhes', 'paciente', 'periodo', 'funcao']:
+            if col not in df.columns: df[col] = ''
+            df[col] = df[col].fillna('')
+        # Colunas de baixa cardinalidade como categóricas (menos memória no cache)
+        for col in ['funcao', 'periodo', 'usuario_responsavel']:
+            df[col] = df[col].astype('category')
+
+    return df
+
+def exportar_atendimentos(acesso, inicio=None, fim=None, funcao=None, usuario=None, tamanho_lote=5000):
+    # Para exportações de períodos longos: devolve (colunas, lotes), em que lotes gera listas
+    # de até tamanho_lote tuplas lidas do cursor (datas já como datetime). Sem DataFrame e
+    # sem cache, a memória fica limitada a um lote, qualquer que seja o período.
+    colunas = list(banco.COLUNAS_CONSULTA)
+    consultas = _consulta_atendimentos(acesso, inicio, fim, funcao, usuario, ', '.join(colunas))
+    i_datas = [colunas.index('inicio'), colunas.index('termino')]
+
+    def lotes():
+        conn = banco.leitura()
+        for query, params, arquivos in consultas:
+            if arquivos: banco.anexar(conn, arquivos)
+            cursor = conn.execute(query, params)
+            try:
+                while True:
+                    lote = cursor.fetchmany(tamanho_lote)
+                    if not lote: break
+                    for i, registro in enumerate(lote):
+                        registro = list(registro)
+                        for c in i_datas:
+                            if registro[c] is not None: registro[c] = banco.EPOCH + timedelta(seconds=registro[c])
+                        lote[i] = registro
+                    yield lote
+            finally:
+                cursor.close()
+    return colunas, lotes()
+
+def _expressao_fts(termo):
+    # Cada palavra vira um prefixo entre aspas ("mar"* "jos"*): E implícito, sem operadores do usuário
+    return ' '.join('"' + p.replace('"', '""') + '"*' for p in termo.split())
+
+@desempenho.instrumentar
+def buscar_atendimentos(acesso, termo, limite=20, apos=None, usuario=None):
+    # Paginação por chave em (inicio, id) decrescente; apos = cursor devolvido pela página anterior
+    # Busca em todos os anos: cada ano arquivado tem o próprio índice FTS
+    where, params = _filtro_acesso(acesso, usuario)
+    where = ['f.atendimentos_fts MATCH ?'] + [f'a.{w}' for w in where]; params = [_expressao_fts(termo)] + params
+    if apos is not None: where.append('(a.inicio, a.id) < (?, ?)'); params += list(apos)
+    colunas = ', '.join(f'a.{c}' for c in banco.COLUNAS_CONSULTA)
+    # Blocos do mais recente para o mais antigo: a leitura para quando a página estiver completa
+    consultas = []
+    for w, p, arquivos in reversed(_consultas_por_bloco(where, params, coluna='a.inicio')):
+        partes = [f'SELECT {colunas} FROM {e}.atendimentos_fts f JOIN {e}.atendimentos a ON a.id = f.rowid WHERE '
+                  + ' AND '.join(w) for e in ['main'] + [banco.esquema_arquivo(ano) for ano in arquivos]]
+        query = ' UNION ALL '.join(partes) + ' ORDER BY inicio DESC, id DESC LIMIT ?'
+        consultas.append((query, p * len(partes) + [limite + 1], arquivos))
+    df = cache.leituras.obter(('busca', _chave(consultas)), lambda: _ler_atendimentos(consultas, limite + 1).iloc[:limite + 1])
+    proximo = None
+    if len(df) > limite:
+        df = df.iloc[:limite]
+        proximo = (banco.para_epoch(df['inicio'].iloc[-1]), int(df['id'].iloc[-1]))
+    return df, proximo
+
+@desempenho.instrumentar
+def listar_anos(acesso):
+    # Um seek no índice por ano existente, em vez de ler a tabela inteira
+    # Anos arquivados vêm do resumo_mensal, que continua no banco principal
+    where, params = _filtro_acesso(acesso)
+    query = "SELECT strftime('%Y', inicio, 'unixepoch') FROM atendimentos WHERE " + ' AND '.join(where + ['inicio >= ?'])
+    query += ' ORDER BY inicio LIMIT 1'
+    arquivados = list(_arquivos())
+    return cache.leituras.obter(('anos', tuple(params), tuple(arquivados)), lambda: _ler_anos(query, params, where, arquivados))
+
+@desempenho.instrumentar
+def _ler_anos(query, params, where, arquivados):
+    conn = banco.leitura()
+    anos, proximo = [], -2**63
+    while True:
+        row = conn.execute(query, params + [proximo]).fetchone()
+        if row is None or not row[0]: break
+        anos.append(int(row[0]))
+        proximo = banco.para_epoch(datetime(anos[-1] + 1, 1, 1))
+    if arquivados:
+        query = f"SELECT DISTINCT ano FROM resumo_mensal WHERE ano IN ({', '.join('?' * len(arquivados))})"
+        anos += [row[0] for row in conn.execute(query + ''.join(f' AND {w}' for w in where), arquivados + params)]
+    return sorted(set(anos))
+
+@desempenho.instrumentar
+def listar_distintos(acesso, coluna):
+    # coluna: 'funcao' ou 'usuario_responsavel' (ambas cobertas por índice)
+    if coluna not in ('funcao', 'usuario_responsavel'): raise ValueError(f"Coluna inválida: {coluna}")
+    where, params = _filtro_acesso(acesso)
+    query = f'SELECT DISTINCT {coluna} FROM atendimentos'
+    if where: query += ' WHERE ' + ' AND '.join(where)
+    arquivados = list(_arquivos())
+    if arquivados:
+        # Valores que só existem nos anos arquivados vêm do resumo_mensal
+        query += f" UNION SELECT {coluna} FROM resumo_mensal WHERE ano IN ({', '.join('?' * len(arquivados))})"
+        query += ''.join(f' AND {w}' for w in where)
+        params = params + arquivados + params
+    return cache.leituras.obter(('distintos', query, tuple(params)), lambda: _ler_distintos(query, params))
+
+@desempenho.instrumentar
+def _ler_distintos(query, params):
+    valores = [row[0] if row[0] is not None else '' for row in banco.leitura().execute(query, params)]
+    return sorted(set(valores))
+
+
+# --- RESUMO MENSAL ---
+def _filtro_resumo(acesso, funcao=None, usuario=None):
+    where, params = _filtro_acesso(acesso, usuario)
+    if funcao is not None: where.append('funcao = ?'); params.append(funcao)
+    return where, params
+
+@desempenho.instrumentar
+def carregar_metricas(acesso, ano, mes, funcao=None, usuario=None):
+    # KPIs lidos do resumo_mensal: O(grupos do mês) em vez de varrer os atendimentos
+    where, params = _filtro_resumo(acesso, funcao, usuario)
+    where += ['ano = ?', 'mes = ?']; params += [ano, mes]
+    query = 'SELECT coalesce(sum(valor), 0), coalesce(sum(horas), 0), coalesce(sum(qtd), 0) FROM resumo_mensal'
+    query += ' WHERE ' + ' AND '.join(where)
+    return cache.leituras.obter(('metricas', query, tuple(params)), lambda: _ler_metricas(query, params))
+
+@desempenho.instrumentar
+def _ler_metricas(query, params):
+    valor, horas, qtd = banco.leitura().execute(query, params).fetchone()
+    return {'valor': valor, 'horas': horas, 'qtd': qtd}
+
+@desempenho.instrumentar
+def carregar_tendencia(acesso, ano, mes, funcao=None, usuario=None, meses=12):
+    # Série dos últimos `meses` meses até (ano, mes), também a partir do resumo_mensal
+    ini = ano * 12 + mes - meses
+    where, params = _filtro_resumo(acesso, funcao, usuario)
+    where += ['ano * 100 + mes BETWEEN ? AND ?']; params += [(ini // 12) * 100 + ini % 12 + 1, ano * 100 + mes]
+    query = 'SELECT ano, mes, sum(valor) AS valor, sum(horas) AS horas, sum(qtd) AS qtd FROM resumo_mensal'
+    query += ' WHERE ' + ' AND '.join(where) + ' GROUP BY ano, mes ORDER BY ano, mes'
+    return cache.leituras.obter(('tendencia', query, tuple(params)), lambda: pd.read_sql(query, banco.leitura(), params=params))
+
+@desempenho.instrumentar
+def reconstruir_resumo(acesso):
+    _exigir_admin(acesso)
+    banco.reconstruir_resumo_completo()
+    cache.invalidar()
+
+
+# --- ARQUIVAMENTO ---
+@desempenho.instrumentar
+def listar_arquivos(acesso):
+    _exigir_admin(acesso)
+    df = pd.read_sql('SELECT ano, arquivo, qtd, arquivado_em FROM arquivos ORDER BY ano', banco.leitura())
+    df['arquivado_em'] = pd.to_datetime(df['arquivado_em'], unit='s')
+    return df
+
+@desempenho.instrumentar
+def arquivar_ano(acesso, ano, compactar=False):
+    # Só anos fechados; os atendimentos continuam visíveis (somente leitura) em todas as telas
+    _exigir_admin(acesso)
+    if ano >= datetime.now().year: raise ValueError("Só é possível arquivar anos já encerrados.")
+    movidos = banco.arquivar_ano(ano)
+    with banco.transacao():
+        _indice.limpar()  # as linhas saíram da tabela sem passar pelo log de mudanças
+    cache.invalidar()
+    if compactar: banco.compactar()
+    return movidos
+
+
+# --- IMPORTAÇÃO EM LOTE ---
+COLUNAS_OBRIGATORIAS = ['inicio', 'termino', 'funcao', 'paciente']
+# Aceita também os cabeçalhos exibidos/exportados em Relatórios
+ALIASES_IMPORTACAO = {'início': 'inicio', 'término': 'termino', 'função': 'funcao', 'período': 'periodo',
+                      'resp.': 'usuario_responsavel', 'responsável': 'usuario_responsavel',
+                      'responsavel': 'usuario_responsavel', 'usuario': 'usuario_responsavel', 'usuário': 'usuario_responsavel'}
+
+def _ler_lotes(arquivo, nome_arquivo, tamanho_lote):
+    nome = nome_arquivo.lower()
+    if nome.endswith('.xls'):
+        raise ValueError('Formato .xls não suportado: salve a planilha como .xlsx ou CSV.')
+    if nome.endswith('.xlsx'):
+        # Arquivo corrompido ou que não é planilha: o erro do openpyxl vira mensagem para o usuário
+        try: df = pd.read_excel(arquivo, dtype=str).fillna('')
+        except Exception as e: raise ValueError(f'Não foi possível ler a planilha: {e}') from e
+        for ini in range(0, len(df), tamanho_lote): yield df.iloc[ini:ini + tamanho_lote]
+        return
+    if hasattr(arquivo, 'read'): bruto = arquivo.read()
+    else:
+        with open(arquivo, 'rb') as f: bruto = f.read()
+    # Planilhas salvas pelo Excel no Windows costumam vir em cp1252
+    try: texto = bruto.decode('utf-8-sig')
+    except UnicodeDecodeError: texto = bruto.decode('cp1252', 'replace')
+    primeira = texto.split('\n', 1)[0]
+    sep = ';' if primeira.count(';') > primeira.count(',') else ','
+    yield from pd.read_csv(io.StringIO(texto), sep=sep, dtype=str, keep_default_na=False, chunksize=tamanho_lote)
+
+FORMATOS_DATA_BR = ['%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y']
+
+def _converter_datas(serie):
+    # ISO primeiro (caminho rápido); o que falhar tenta só os formatos brasileiros exatos.
+    # Nada de inferência: "2024-13-01" ou "05/13/2024" ficam inválidos em vez de virar outra data.
+    datas = pd.to_datetime(serie, errors='coerce', format='ISO8601')
+    for formato in FORMATOS_DATA_BR:
+        falhas = datas.isna() & (serie != '')
+        if not falhas.any(): break
+        datas[falhas] = pd.to_datetime(serie[falhas], errors='coerce', format=formato)
+    return datas
+
+def _validar_lote(lote, precos, usuario_padrao):
+    lote = lote.rename(columns=lambda c: ALIASES_IMPORTACAO.get(str(c).strip().lower(), str(c).strip().lower()))
+    faltando = [c for c in COLUNAS_OBRIGATORIAS if c not in lote.columns]
+    if faltando: raise ValueError(f"Colunas obrigatórias ausentes: {', '.join(faltando)}")
+    texto = {c: lote[c].astype(str).str.strip() if c in lote.columns else pd.Series('', index=lote.index)
+             for c in ['funcao', 'paciente', 'detalhes', 'usuario_responsavel']}
+    ini, fim = _converter_datas(lote['inicio'].astype(str).str.strip()), _converter_datas(lote['termino'].astype(str).str.strip())
+    valor_hora = texto['funcao'].map(precos['valor_hora'])
+
+    erros = pd.Series('', index=lote.index)
+    for mascara, msg in [(ini.isna(), 'início inválido'),
+                         (fim.isna(), 'término inválido'),
+                         (ini.notna() & fim.notna() & (fim <= ini), 'término deve ser depois do início'),
+                         (valor_hora.isna(), 'função não cadastrada (' + texto['funcao'] + ')'),
+                         (texto['paciente'] == '', 'paciente obrigatório')]:
+        erros = erros.mask(mascara, erros + '; ' + msg)
+    ok = erros == ''
+
+    # Preço, período e epoch calculados por coluna; período usa a própria calcular_periodo por hora
+    periodos = {h: calcular_periodo(time(h)) for h in range(24)}
+    ini_ok, fim_ok = ini[ok], fim[ok]
+    linhas = pd.DataFrame({
+        'inicio': (ini_ok - banco.EPOCH) // pd.Timedelta(seconds=1),
+        'termino': (fim_ok - banco.EPOCH) // pd.Timedelta(seconds=1),
+        'funcao': texto['funcao'][ok],
+        'valor_total': (fim_ok - ini_ok).dt.total_seconds() / 3600 * valor_hora[ok],
+        'usuario_responsavel': texto['usuario_responsavel'][ok].replace('', usuario_padrao),
+        'detalhes': texto['detalhes'][ok],
+        'paciente': texto['paciente'][ok],
+        'periodo': ini_ok.dt.hour.map(periodos),
+        'funcao_id': texto['funcao'][ok].map(precos['id']),
+    })
+    df_erros = lote.loc[~ok].astype(str).assign(erro=erros[~ok].str[2:])
+    # tolist() entrega tipos nativos do Python, que o sqlite3 aceita direto. lote.loc[ok]: linhas
+    # originais das válidas, para o relatório se alguma for rejeitada por conflito na gravação
+    return (list(zip(*(linhas[c].tolist() for c in banco.COLUNAS_ATENDIMENTO))), (linhas.index + 2).tolist(),
+            df_erros, lote.loc[ok])
+
+def _ordenar_relatorio(df_erros):
+    # Linha e motivo primeiro, depois as colunas do arquivo como vieram
+    return df_erros[['linha', 'erro'] + [c for c in df_erros.columns if c not in ('linha', 'erro')]]
+
+@desempenho.instrumentar
+def importar_atendimentos(acesso, arquivo, nome_arquivo, usuario_padrao, somente_sem_erros=False, tamanho_lote=5000):
+    # Valida tudo em lotes e grava as linhas válidas numa única transação (executemany).
+    # Devolve (quantidade inserida, DataFrame com linha do arquivo e motivo de cada rejeição).
+    _exigir_admin(acesso)
+    funcs = carregar_funcoes()
+    precos = funcs.sort_values('id').drop_duplicates('nome').set_index('nome')[['id', 'valor_hora']]
+    validas, numeros, relatorio, originais = [], [], [], []
+    for lote in _ler_lotes(arquivo, nome_arquivo, tamanho_lote):
+        linhas, nums, df_erros, df_validas = _validar_lote(lote, precos, usuario_padrao)
+        validas.extend(linhas)
+        numeros.extend(nums)
+        originais.append(df_validas)
+        if not df_erros.empty: relatorio.append(df_erros.assign(linha=df_erros.index + 2))
+    df_erros = _ordenar_relatorio(pd.concat(relatorio) if relatorio else pd.DataFrame(columns=['linha', 'erro']))
+    if not validas or (somente_sem_erros and not df_erros.empty):
+        return 0, df_erros
+    with banco.transacao() as conn:
+        # Conflitos de horário só podem ser checados aqui, com a escrita já serializada
+        motivos = _conflitos_lote(conn, validas, numeros)
+        if motivos:
+            linhas = [numeros[p] for p in motivos]
+            conflitos = pd.concat(originais).loc[[n - 2 for n in linhas]].astype(str).assign(
+                erro=list(motivos.values()), linha=linhas)
+            df_erros = _ordenar_relatorio(pd.concat([df_erros, conflitos]).sort_values('linha', ignore_index=True))
+            validas = [] if somente_sem_erros else [linha for p, linha in enumerate(validas) if p not in motivos]
+        if validas: banco.inserir_atendimentos(conn, validas)
+    cache.invalidar()
+    return len(validas), df_erros